@@ -18,17 +18,20 @@ from scipy.spatial.distance import pdist
 from scipy.cluster.hierarchy import cophenet
 import scipy.integrate as integrate
 import scipy.special as special
+from scipy.linalg import cho_factor, cho_solve, get_lapack_funcs
 
 # others
 import getpass as gp
 import sys
 import os
+import json
+import hashlib
+from multiprocessing import shared_memory
 import pandas as pd
 import random
 import math
 import seaborn as sns
 from collections import OrderedDict
-import sklearn.covariance
 from sklearn.covariance import ledoit_wolf as LW, oas,  shrunk_covariance
 #import cvxopt as opt
 #from cvxopt import blas, solvers
@@ -58,12 +61,12 @@ def get_Data(freq, years):
     '''Import main data into python'''
     os.chdir("/Users/%s/OneDrive/Master Thesis/Data" %name)
     file = 'data_main.xlsx'
-    xl = pd.ExcelFile(file)
-    returns = xl.parse('Return_Data_M', index_col = 'Code')
-    rf_rate = xl.parse('yields', index_col = 'Code')[:-1]
+    sheets = read_excel_cached(file, ['Return_Data_M', 'yields', 'market'], index_col = 'Code')
+    returns = sheets['Return_Data_M']
+    rf_rate = sheets['yields'][:-1]
     estLength = years * 12
     nAssets = len(returns.columns)
-    market = xl.parse('market', index_col = 'Code')
+    market = sheets['market']
     
     return returns, rf_rate, market, estLength, nAssets
 
@@ -73,15 +76,700 @@ def get_Data_control(freq, years):
     '''Import control data into python'''
     os.chdir("/Users/%s/OneDrive/Master Thesis/Data" %name)
     file = 'data_control.xlsx'
-    xl = pd.ExcelFile(file)
-    returns = xl.parse('Return_Data_M', index_col = 'Code')
-    rf_rate = xl.parse('yields', index_col = 'Code')
-    market = xl.parse('market', index_col = 'Code')
+    sheets = read_excel_cached(file, ['Return_Data_M', 'yields', 'market'], index_col = 'Code')
+    returns = sheets['Return_Data_M']
+    rf_rate = sheets['yields']
+    market = sheets['market']
     nAssets = len(returns.columns)
     estLength = years * 12    
     return returns, rf_rate, market, estLength, nAssets
 
 
+#process-wide registry of loaded datasets, see get_dataset
+_DATASET_LOADERS = {'main': get_Data, 'control': get_Data_control}
+_DATASETS = {}
+_DATASET_VIEWS = {}
+_MOMENT_INDEXES = {}
+_CALENDARS = {}
+
+
+def read_only_frame(df):
+    '''Copy of a dataframe backed by a single read-only array'''
+    values = np.array(df.values, copy = True)
+    values.flags.writeable = False
+    return pd.DataFrame(values, index = df.index, columns = df.columns, copy = False)
+
+
+def get_dataset(dataset = 'main', years = 10, freq = 'M'):
+    '''Same output as get_Data / get_Data_control, but the data is read from disk only once per process.
+       The frames handed out are read-only and shared between all callers, keyed by (dataset, years).'''
+    if (dataset, years) not in _DATASET_VIEWS:
+        if dataset not in _DATASETS:
+            returns, rf_rate, market, estLength, nAssets = _DATASET_LOADERS[dataset](freq, years)
+            _DATASETS[dataset] = (read_only_frame(returns),
+                                  read_only_frame(rf_rate),
+                                  read_only_frame(market))
+        returns, rf_rate, market = _DATASETS[dataset]
+        _DATASET_VIEWS[(dataset, years)] = (returns, rf_rate, market, years * 12, len(returns.columns))
+    return _DATASET_VIEWS[(dataset, years)]
+
+
+def clear_datasets():
+    '''Drop every dataset held by get_dataset, e.g. after the workbook was updated'''
+    _DATASETS.clear()
+    _DATASET_VIEWS.clear()
+    _MOMENT_INDEXES.clear()
+    _CALENDARS.clear()
+
+
+def share_dataset(data, path = None):
+    '''Put the returns, rf and market of a get_dataset tuple in shared memory (or a memory-mapped file at path).
+       Returns (spec, handle): spec is sent to the workers (attach_dataset), handle goes to release_dataset.'''
+    returns, rf_rate, market, estLength, nAssets = data
+    frames = OrderedDict([('returns', returns), ('rf_rate', rf_rate), ('market', market)])
+    layout = OrderedDict()
+    offset = 0
+    for key, df in frames.items():
+        layout[key] = {'offset': offset, 'shape': df.shape,
+                       'index': np.asarray(df.index.values), 'index_name': df.index.name,
+                       'columns': np.asarray(df.columns.values)}
+        offset += df.size * 8
+    size = max(offset, 8)
+
+    if path is None:
+        handle = shared_memory.SharedMemory(create = True, size = size)
+        buffer = handle.buf
+    else:
+        handle = np.memmap(path, dtype = np.uint8, mode = 'w+', shape = (size,))
+        buffer = handle
+    for key, df in frames.items():
+        view = np.ndarray(df.shape, dtype = np.float64, buffer = buffer, offset = layout[key]['offset'])
+        view[:] = np.asarray(df.values, dtype = np.float64)
+    if path is not None:
+        handle.flush()
+
+    spec = {'name': handle.name if path is None else None, 'path': path, 'size': size,
+            'layout': layout, 'estLength': estLength, 'nAssets': nAssets}
+    return spec, handle
+
+
+def attach_dataset(spec):
+    '''Attach to the memory created by share_dataset, in a worker process.
+       Returns (data, handle): data is the usual (returns, rf_rate, market, estLength, nAssets) tuple whose
+       frames are zero-copy, read-only views on the shared memory; handle must outlive the frames.'''
+    if spec['path'] is None:
+        try:
+            #the parent owns the segment, the worker must not unlink it on exit
+            handle = shared_memory.SharedMemory(name = spec['name'], track = False)
+        except TypeError:
+            handle = shared_memory.SharedMemory(name = spec['name'])
+        buffer = handle.buf
+    else:
+        handle = np.memmap(spec['path'], dtype = np.uint8, mode = 'r', shape = (spec['size'],))
+        buffer = handle
+    frames = []
+    for key, item in spec['layout'].items():
+        view = np.ndarray(item['shape'], dtype = np.float64, buffer = buffer, offset = item['offset'])
+        view.flags.writeable = False
+        frames.append(pd.DataFrame(view, index = pd.Index(item['index'], name = item['index_name']),
+                                   columns = item['columns'], copy = False))
+    returns, rf_rate, market = frames
+    return (returns, rf_rate, market, spec['estLength'], spec['nAssets']), handle
+
+
+def release_dataset(handle, unlink = True):
+    '''Release the memory behind share_dataset / attach_dataset (unlink only in the parent)'''
+    if isinstance(handle, np.memmap):
+        #the mapping is closed once the last view on it is garbage collected
+        return
+    handle.close()
+    if unlink:
+        handle.unlink()
+
+
+#compounding periods per year for the data frequencies used in the scripts
+PERIODS_PER_YEAR = {'M': 12, 'W': 52, 'D': 365}
+
+
+class RiskFreeCurve(object):
+    '''Annual risk free yields converted once to monthly, weekly and daily rates.
+       Rolling loops look rates up by integer position instead of converting the window every period.
+
+       EXAMPLE: rf_curve = RiskFreeCurve(rf_rate)
+                rf = rf_curve.window(n, estLength + n, freq)    # replaces the list comprehension over rf_rate[n:estLength+n]
+                rf = rf_curve.rate(estLength + n - 1, freq)     # replaces (1. + rf_rate.iloc[estLength + n - 1]) ** (1. / 12) - 1'''
+
+    def __init__(self, rf_rate, column = 0):
+        if isinstance(rf_rate, pd.DataFrame):
+            rf_rate = rf_rate.iloc[:, column]
+        self.dates = rf_rate.index
+        self.annual = np.asarray(rf_rate.values, dtype = np.float64)
+        self.rates = {freq: (1. + self.annual) ** (1. / periods) - 1
+                      for freq, periods in PERIODS_PER_YEAR.items()}
+
+    def __len__(self):
+        return len(self.annual)
+
+    def position(self, date, side = 'left'):
+        '''integer position of a date; like .loc slicing, a missing date maps to the next available one
+           (side = 'left') or to one past the last date before it (side = 'right')'''
+        return int(self.dates.searchsorted(date, side = side))
+
+    def rate(self, position, freq = 'M'):
+        '''periodic rate at an integer position'''
+        return float(self.rates[freq][position])
+
+    def window(self, start, stop, freq = 'M'):
+        '''periodic rates of the positions start, ..., stop - 1 (a view, no copy)'''
+        return self.rates[freq][start:stop]
+
+    def between(self, start_date, end_date, freq = 'M'):
+        '''periodic rates between two dates, both included, as rf_rate.loc[start_date : end_date]'''
+        return self.window(self.position(start_date), self.position(end_date, side = 'right'), freq)
+
+    def at(self, date, freq = 'M'):
+        '''periodic rate at a date that has to be in the curve'''
+        return self.rate(self.dates.get_loc(date), freq)
+
+
+class TradingCalendar(object):
+    '''Dates of a dataset mapped to integer offsets, built once per dataset.
+       Frames (weights, returns, ...) are aligned to a schedule of dates up front, so that rolling loops
+       index contiguous arrays and a missing date raises once, before the loop, instead of mid-loop.'''
+
+    #step between two consecutive dates for each data frequency
+    STEPS = {'M': relativedelta(months = 1), 'W': relativedelta(weeks = 1), 'D': relativedelta(days = 1)}
+
+    def __init__(self, dates, freq = 'M'):
+        self.dates = pd.DatetimeIndex(dates)
+        self.freq = freq
+
+    def __len__(self):
+        return len(self.dates)
+
+    def schedule(self, start, periods, offset = 0):
+        '''dates start + (offset + n) steps for n = 0, ..., periods - 1'''
+        step = self.STEPS[self.freq]
+        return pd.DatetimeIndex([start + step * (offset + n) for n in range(periods)])
+
+    def positions(self, dates, index = None, what = 'dates'):
+        '''integer positions of dates in index (default: the calendar); raises if any date is missing'''
+        index = self.dates if index is None else pd.DatetimeIndex(index)
+        pos = index.get_indexer(pd.DatetimeIndex(dates))
+        if (pos < 0).any():
+            missing = [str(d.date()) for d in pd.DatetimeIndex(dates)[pos < 0]]
+            raise ValueError('{} missing for {} date(s): {}'.format(what, len(missing), ', '.join(missing[:5])))
+        return pos
+
+    def align(self, frame, dates, what = 'rows'):
+        '''rows of frame at dates as an array; a plain slice (no copy) when the dates are consecutive rows'''
+        pos = self.positions(dates, frame.index, what)
+        values = frame.values
+        if len(pos) > 0 and np.all(np.diff(pos) == 1):
+            return values[pos[0]:pos[-1] + 1]
+        return values[pos]
+
+
+def _window_block(N, block = None):
+    '''number of N x N windows per block of the blockwise estimators, by default about 2 MB of float64'''
+    return block if block is not None else max(1, 2 ** 18 // (N * N))
+
+
+class MomentIndex(object):
+    '''Cumulative sums of the returns and of their outer products, built once per dataset.
+       Mean and covariance of any window (start, length) are then differences of two prefix sums, O(N^2)
+       per query whatever the estimation length, so all estimation lengths share one precomputation.
+       The returns are centered on their full-sample mean before summing, which keeps the prefix sums
+       small and the covariance free of cancellation error.
+
+       EXAMPLE: moments = MomentIndex(returns)
+                meanRet = moments.mean(n, estLength)    # replaces np.mean(returns[n:estLength+n])
+                estSigma = moments.cov(n, estLength)    # replaces np.cov(returns[n:estLength+n].T)'''
+
+    def __init__(self, returns):
+        values = np.asarray(returns, dtype = np.float64)
+        self.index = getattr(returns, 'index', None)
+        self.columns = getattr(returns, 'columns', None)
+        self.center = values.mean(axis = 0)
+        centered = values - self.center
+        T, N = centered.shape
+        self.sums = np.zeros((T + 1, N))
+        np.cumsum(centered, axis = 0, out = self.sums[1:])
+        self.products = np.zeros((T + 1, N, N))
+        np.cumsum(centered[:, :, None] * centered[:, None, :], axis = 0, out = self.products[1:])
+
+    def __len__(self):
+        return len(self.sums) - 1
+
+    def _check(self, start, length):
+        if length < 1 or np.min(start) < 0 or np.max(start) + length > len(self):
+            raise IndexError('window ({}, {}) outside of the {} observations'.format(start, length, len(self)))
+
+    def mean(self, start, length):
+        '''mean returns of the rows start, ..., start + length - 1'''
+        self._check(start, length)
+        return (self.sums[start + length] - self.sums[start]) / length + self.center
+
+    def cov(self, start, length, ddof = 1):
+        '''covariance matrix of the rows start, ..., start + length - 1, as np.cov(window.T, ddof = ddof)'''
+        self._check(start, length)
+        s = self.sums[start + length] - self.sums[start]
+        Q = self.products[start + length] - self.products[start]
+        return (Q - np.outer(s, s) / length) / (length - ddof)
+
+    def means(self, starts, length, dtype = None):
+        '''mean returns of several windows of the same length, one row per start'''
+        starts = np.asarray(starts)
+        self._check(starts, length)
+        means = (self.sums[starts + length] - self.sums[starts]) / length + self.center
+        return means if dtype is None else means.astype(dtype)
+
+    def covs(self, starts, length, ddof = 1, dtype = None, block = None):
+        '''covariance matrices of several windows of the same length, shape (len(starts), N, N);
+           the sums stay in float64, block windows at a time written into a stack of the given dtype,
+           so dtype = np.float32 never holds the float64 stack in full'''
+        starts = np.asarray(starts)
+        self._check(starts, length)
+        N = self.sums.shape[1]
+        block = _window_block(N, block)
+        covs = np.empty((len(starts), N, N), dtype = np.float64 if dtype is None else dtype)
+        for a in range(0, len(starts), block):
+            part = starts[a:a + block]
+            s = self.sums[part + length] - self.sums[part]
+            Q = self.products[part + length] - self.products[part]
+            Q -= s[:, :, None] * s[:, None, :] / length
+            Q /= length - ddof
+            covs[a:a + block] = Q
+        return covs
+
+
+def get_moment_index(dataset = 'main'):
+    '''MomentIndex of the returns of a dataset loaded by get_dataset, built once per process'''
+    if dataset not in _MOMENT_INDEXES:
+        returns = get_dataset(dataset)[0]
+        _MOMENT_INDEXES[dataset] = MomentIndex(returns)
+    return _MOMENT_INDEXES[dataset]
+
+
+def get_calendar(dataset = 'main', freq = 'M'):
+    '''TradingCalendar of the dates of a dataset loaded by get_dataset, built once per process'''
+    if (dataset, freq) not in _CALENDARS:
+        returns = get_dataset(dataset, freq = freq)[0]
+        _CALENDARS[(dataset, freq)] = TradingCalendar(returns.index, freq)
+    return _CALENDARS[(dataset, freq)]
+
+
+def rolling_windows(returns, length, dtype = None):
+    '''All rolling estimation windows of the returns as one read-only array of shape (W, length, N),
+       W = T - length + 1, window n being the rows n, ..., n + length - 1 (returns[n:length+n]).
+       It is a strided view of the returns array, nothing is copied (unless dtype asks for a conversion,
+       e.g. dtype = np.float32, in which case the T x N array is converted once).'''
+    values = np.asarray(returns, dtype = dtype)
+    windows = np.lib.stride_tricks.sliding_window_view(values, length, axis = 0)
+    windows = np.swapaxes(windows, 1, 2)
+    windows.flags.writeable = False
+    return windows
+
+
+def batched_mean(windows):
+    '''mean returns of every window of a (W, T, N) stack, shape (W, N)'''
+    return windows.mean(axis = 1)
+
+
+def batched_cov(windows, ddof = 1):
+    '''covariance matrix of every window of a (W, T, N) stack, shape (W, N, N), as np.cov(window.T, ddof = ddof);
+       computed in the dtype of the windows'''
+    centered = windows - windows.mean(axis = 1, keepdims = True)
+    return np.einsum('wti,wtj->wij', centered, centered, optimize = True) / (windows.shape[1] - ddof)
+
+
+def rolling_shrunk_cov(returns, length, method = 'lw', assume_centered = False, dtype = None, block = None):
+    '''Ledoit-Wolf ('lw') or OAS ('oas') shrunk covariance of every window returns[n:length+n], as sklearn per window.
+       Returns the covariances (W, N, N), in dtype if given, and the shrinkage intensities (W,).'''
+    if method not in ('lw', 'oas'):
+        raise ValueError("method must be 'lw' or 'oas', not {!r}".format(method))
+    values = np.asarray(returns, dtype = np.float64)
+    T, N = values.shape
+    W = T - length + 1
+    n = float(length)
+    #shift to the full-sample mean against cancellation, the centered estimators do not depend on it
+    x = values if assume_centered else values - values.mean(axis = 0)
+    
+    def window_sums(a):
+        cum = np.zeros((T + 1,) + a.shape[1:])
+        np.cumsum(a, axis = 0, out = cum[1:])
+        return cum[length:] - cum[:-length]
+    
+    squares = (x ** 2).sum(axis = 1)
+    S1 = window_sums(x)
+    S3 = window_sums(squares[:, None] * x)
+    S4 = window_sums(squares ** 2)
+    
+    block = _window_block(N, block)
+    shrunk = np.empty((W, N, N), dtype = np.float64 if dtype is None else dtype)
+    shrinkage = np.empty(W)
+    for a in range(0, W, block):
+        b = min(a + block, W)
+        #sums of x x' of the windows a, ..., b - 1: the first one directly, then row added minus row dropped
+        s2 = np.empty((b - a, N, N))
+        s2[0] = np.dot(x[a:a + length].T, x[a:a + length])
+        added, dropped = x[a + length:b + length - 1], x[a:b - 1]
+        np.cumsum(added[:, :, None] * added[:, None, :] - dropped[:, :, None] * dropped[:, None, :],
+                  axis = 0, out = s2[1:])
+        s2[1:] += s2[0]
+        s1, s3, s4 = S1[a:b], S3[a:b], S4[a:b]
+        
+        m = np.zeros_like(s1) if assume_centered else s1 / n
+        emp_cov = s2 / n - m[:, :, None] * m[:, None, :]
+        trace = np.trace(emp_cov, axis1 = 1, axis2 = 2)
+        mu = trace / N
+        delta_ = (emp_cov ** 2).sum(axis = (1, 2))
+        
+        if method == 'lw':
+            #sum over the window of |x - m|^4, expanded in the window sums
+            mm = (m ** 2).sum(axis = 1)
+            beta_ = (s4 - 4. * np.einsum('wi,wi->w', m, s3) + 4. * np.einsum('wi,wij,wj->w', m, s2, m)
+                     + 2. * mm * np.trace(s2, axis1 = 1, axis2 = 2) - 4. * mm * np.einsum('wi,wi->w', m, s1) + n * mm ** 2)
+            beta = (beta_ / n - delta_) / (N * n)
+            delta = (delta_ - 2. * mu * trace + N * mu ** 2) / N
+            beta = np.minimum(beta, delta)
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                shrinkage[a:b] = np.where(beta == 0, 0., beta / delta)
+        else:
+            alpha = delta_ / N ** 2
+            num = alpha + mu ** 2
+            den = (n + 1.) * (alpha - mu ** 2 / N)
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                shrinkage[a:b] = np.where(den == 0, 1., np.minimum(num / den, 1.))
+        
+        emp_cov *= (1. - shrinkage[a:b])[:, None, None]
+        emp_cov += (shrinkage[a:b] * mu)[:, None, None] * np.eye(N)
+        shrunk[a:b] = emp_cov
+    return shrunk, shrinkage
+
+
+def rolling_higher_moments(returns, length, lower = 5, upper = 95):
+    '''Skewness, excess kurtosis (as pandas) and tail ratio of every asset over every window returns[n:length+n].
+       Returns three (W, N) panels, indexed by the last date of each window for DataFrame input.'''
+    values = np.asarray(returns, dtype = np.float64)
+    T, N = values.shape
+    W = T - length + 1
+    n = float(length)
+    
+    x = values - values.mean(axis = 0)
+    cum = np.zeros((4, T + 1, N))
+    power = np.ones_like(x)
+    for k in range(4):
+        power = power * x
+        np.cumsum(power, axis = 0, out = cum[k, 1:])
+    S1, S2, S3, S4 = cum[:, length:] - cum[:, :-length]
+    m = S1 / n
+    M2 = S2 - n * m ** 2
+    M3 = S3 - 3. * m * S2 + 2. * n * m ** 3
+    M4 = S4 - 4. * m * S3 + 6. * m ** 2 * S2 - 3. * n * m ** 4
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        skew = np.sqrt(n * (n - 1.)) / (n - 2.) * (M3 / n) / (M2 / n) ** 1.5
+        kurt = (n * (n + 1.) * (n - 1.) * M4 / ((n - 2.) * (n - 3.) * M2 ** 2)
+                - 3. * (n - 1.) ** 2 / ((n - 2.) * (n - 3.)))
+    
+    #sliding sorted windows, one row per asset
+    rows = np.arange(N)
+    cols = np.arange(length)[None, :]
+    ordered = np.sort(values[:length].T, axis = 1)
+    percentiles = np.empty((W, 2, N))
+    positions = np.array([lower, upper]) / 100. * (length - 1)
+    low = np.floor(positions).astype(int)
+    high = np.minimum(low + 1, length - 1)
+    frac = positions - low
+    for w in range(W):
+        if w > 0:
+            old, new = values[w - 1], values[w + length - 1]
+            out = (ordered < old[:, None]).sum(axis = 1)
+            into = (ordered < new[:, None]).sum(axis = 1) - (old < new)
+            k = np.where(cols < into[:, None], cols, cols - 1)
+            source = np.where(k < out[:, None], k, k + 1)
+            ordered = np.take_along_axis(ordered, np.clip(source, 0, length - 1), axis = 1)
+            ordered[rows, into] = new
+        percentiles[w] = ordered[:, low].T + frac[:, None] * (ordered[:, high] - ordered[:, low]).T
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        tail = np.abs(percentiles[:, 1]) / np.abs(percentiles[:, 0])
+    
+    if isinstance(returns, pd.DataFrame):
+        dates = returns.index[length - 1:]
+        return tuple(pd.DataFrame(panel, index = dates, columns = returns.columns) for panel in (skew, kurt, tail))
+    return skew, kurt, tail
+
+
+def iter_blocks(returns, block):
+    '''a returns DataFrame cut in blocks of rows, an iterable of DataFrames (e.g. read_csv(..., chunksize = ...))
+       is passed through as it is'''
+    if isinstance(returns, pd.DataFrame):
+        for start in range(0, len(returns), block):
+            yield returns.iloc[start:start + block]
+    else:
+        for chunk in returns:
+            yield chunk
+
+
+def rolling_weights_chunked(returns, length, allocator, rebalance = None, block = 2520, ddof = 1, refresh = 250):
+    '''Rolling-window weights of a long (e.g. daily) return panel read in blocks of rows, e.g. csv chunks.
+       allocator(meanRet, varCovar) gives the weights of one window; rebalance = None rebalances on every row,
+       a pandas frequency (e.g. 'M') on the last row of each period. Returns a DataFrame indexed by the window ends.'''
+    weights, dates = [], []
+    columns, tail, tail_dates = None, None, None
+    offset = 0              # global position of the first row kept
+    last = -1               # global position of the last row in the window sums
+    steps = 0
+    for chunk in iter_blocks(returns, block):
+        if columns is None:
+            columns = chunk.columns
+            N = len(columns)
+            center = np.asarray(chunk.values, dtype = np.float64).mean(axis = 0)
+            s1, s2 = np.zeros(N), np.zeros((N, N))
+            tail, tail_dates = np.empty((0, N)), chunk.index[:0]
+        buf = np.vstack([tail, np.asarray(chunk.values, dtype = np.float64) - center])
+        buf_dates = tail_dates.append(chunk.index)
+        end = offset + len(buf)
+        
+        #a row is a rebalancing date once the next row is known
+        candidates = np.arange(max(last + 1, length - 1) - offset, len(buf) - 1)
+        if rebalance is not None and len(candidates):
+            periods = buf_dates.to_period(rebalance)
+            candidates = candidates[periods[candidates] != periods[candidates + 1]]
+        
+        for t in candidates:
+            e = offset + t
+            if e - last >= length or steps >= refresh:
+                window = buf[t - length + 1:t + 1]
+                s1 = window.sum(axis = 0)
+                s2 = np.dot(window.T, window)
+                steps = 0
+            else:
+                enter = buf[last + 1 - offset:t + 1]
+                leave = buf[last + 1 - length - offset:t + 1 - length]
+                s1 += enter.sum(axis = 0) - leave.sum(axis = 0)
+                s2 += np.dot(enter.T, enter) - np.dot(leave.T, leave)
+                steps += 1
+            last = e
+            meanRet = s1 / length + center
+            varCovar = (s2 - np.outer(s1, s1) / length) / (length - ddof)
+            weights.append(np.ravel(np.asarray(allocator(meanRet, varCovar), dtype = np.float64)))
+            dates.append(buf_dates[t])
+        
+        #keep the rows a later window can still need
+        keep = end - length if last < end - length else last + 1 - length
+        keep = max(keep, offset)
+        tail, tail_dates = buf[keep - offset:], buf_dates[keep - offset:]
+        offset = keep
+    
+    return pd.DataFrame(np.array(weights).reshape(len(dates), -1), index = pd.Index(dates), columns = columns)
+
+
+class RollingPrecision(object):
+    '''Inverse of the covariance matrix of a rolling estimation window, kept up to date with rank-one
+       (Sherman-Morrison) updates instead of being inverted from scratch every period.
+       The engine holds the inverse of the second moment matrix M = X'X of the window (returns centered on
+       their full-sample mean); moving the window by one period is one update (new row) and one downdate
+       (dropped row). The precision then follows from one more rank-one correction for the window mean.
+       M is re-factorised every refresh steps, and whenever the window jumps, to bound the drift.
+
+       EXAMPLE: rolling = RollingPrecision(returns, estLength)
+                for n in range(len(returns.index) - estLength):
+                    invSigma = rolling.seek(n)          # inverse of np.cov(returns[n:estLength+n].T)
+                    weights = minVarPF1(estSigma, invSigma = invSigma)'''
+
+    def __init__(self, returns, length, ddof = 1, refresh = 60):
+        values = np.asarray(returns, dtype = np.float64)
+        self.center = values.mean(axis = 0)
+        self.values = values - self.center
+        self.length = length
+        self.ddof = ddof
+        self.refresh = refresh
+        self.windows = len(values) - length + 1
+        self._factor(0)
+
+    def _factor(self, start):
+        '''second moment matrix of the window at start and its inverse, from scratch'''
+        window = self.values[start:start + self.length]
+        self.start = start
+        self.sums = window.sum(axis = 0)
+        self.M = np.dot(window.T, window)
+        self.Minv = mat_inv(self.M)
+        self.steps = 0
+
+    def _rank_one(self, x, sign):
+        u = np.dot(self.Minv, x)
+        self.Minv -= sign * np.outer(u, u) / (1. + sign * np.dot(x, u))
+        self.M += sign * np.outer(x, x)
+        self.sums += sign * x
+
+    def step(self):
+        '''move the window one period forward'''
+        if self.start + 1 >= self.windows:
+            raise IndexError('last window reached')
+        self.steps += 1
+        if self.steps >= self.refresh:
+            self._factor(self.start + 1)
+            return
+        self._rank_one(self.values[self.start + self.length], 1.)
+        self._rank_one(self.values[self.start], -1.)
+        self.start += 1
+
+    def seek(self, start):
+        '''move the window to rows start, ..., start + length - 1 and return its precision matrix'''
+        if start == self.start + 1:
+            self.step()
+        elif start != self.start:
+            if not 0 <= start < self.windows:
+                raise IndexError('window {} outside of the {} windows'.format(start, self.windows))
+            self._factor(start)
+        return self.precision
+
+    @property
+    def mean(self):
+        return self.sums / self.length + self.center
+
+    @property
+    def cov(self):
+        return (self.M - np.outer(self.sums, self.sums) / self.length) / (self.length - self.ddof)
+
+    @property
+    def precision(self):
+        '''inverse of cov: (M - s s'/L)^-1 = M^-1 + M^-1 s s' M^-1 / (L - s' M^-1 s), times L - ddof'''
+        u = np.dot(self.Minv, self.sums)
+        P = (self.Minv + np.outer(u, u) / (self.length - np.dot(self.sums, u))) * (self.length - self.ddof)
+        return (P + P.T) / 2.
+
+
+def _label_array(labels):
+    '''index or column labels as an array np.load reads without pickle: object labels become fixed-width str'''
+    values = np.asarray(labels.values)
+    if values.dtype == object:
+        values = np.array([str(x) for x in values], dtype = str)
+    return values
+
+
+def _json_cell(x):
+    '''json encoding of the cells of an object table (numpy scalars and arrays, dates)'''
+    if isinstance(x, np.generic):
+        return x.item()
+    if isinstance(x, np.ndarray):
+        return x.tolist()
+    if isinstance(x, datetime):
+        return {'__datetime__': x.isoformat()}
+    raise TypeError('{!r} cannot be stored by save_frames'.format(type(x)))
+
+
+def _json_datetime(obj):
+    return pd.Timestamp(obj['__datetime__']) if '__datetime__' in obj else obj
+
+
+def save_frames(path, frames, meta = None):
+    '''Store a dict of dataframes column-wise in a single binary .npz file, readable without pickle:
+       labels are saved as str when they are objects and tables of objects as json'''
+    arrays = {'__meta__': np.array(json.dumps(meta if meta is not None else {}))}
+    for key, df in frames.items():
+        if df.values.dtype == object:
+            arrays[key + '/cells'] = np.array(json.dumps(df.values.tolist(), default = _json_cell))
+        else:
+            #column-major layout keeps every column contiguous on disk
+            arrays[key + '/values'] = np.asfortranarray(df.values)
+        arrays[key + '/index'] = _label_array(df.index)
+        arrays[key + '/columns'] = _label_array(df.columns)
+        arrays[key + '/names'] = np.array(json.dumps([df.index.name, df.columns.name]))
+    tmp = '{}.{}.tmp.npz'.format(path, os.getpid())
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+def load_frames(path):
+    '''Read back the dict of dataframes and the metadata written by save_frames'''
+    frames = {}
+    with np.load(path, allow_pickle = False) as npz:
+        meta = json.loads(str(npz['__meta__']))
+        for name in npz.files:
+            if name.endswith('/values'):
+                key = name[:-len('/values')]
+                values = npz[name]
+            elif name.endswith('/cells'):
+                key = name[:-len('/cells')]
+                rows = json.loads(str(npz[name]), object_hook = _json_datetime)
+                #filled cell by cell, cells holding lists must not become an extra dimension
+                values = np.empty((len(rows), len(npz[key + '/columns'])), dtype = object)
+                for i, row in enumerate(rows):
+                    for j, cell in enumerate(row):
+                        values[i, j] = cell
+            else:
+                continue
+            index_name, columns_name = json.loads(str(npz[key + '/names']))
+            frames[key] = pd.DataFrame(values,
+                                       index = pd.Index(npz[key + '/index'], name = index_name),
+                                       columns = pd.Index(npz[key + '/columns'], name = columns_name))
+            if name.endswith('/cells'):
+                frames[key] = frames[key].infer_objects()
+    return frames, meta
+
+
+def file_digest(path, blocksize = 1 << 20):
+    '''sha1 of the content of a file'''
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def frame_digest(df):
+    '''sha1 of the values, index and columns of a dataframe, e.g. to name data derived from a dataset version'''
+    df = pd.DataFrame(df)
+    sha = hashlib.sha1()
+    sha.update(np.ascontiguousarray(df.values).tobytes())
+    sha.update(str(list(df.index)).encode('utf-8'))
+    sha.update(str(list(df.columns)).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def read_excel_cached(file, sheets, index_col = 'Code', cache_dir = '.cache'):
+    '''Parse sheets of an Excel workbook, reusing a binary cache as long as the workbook is unchanged.
+       The cache is keyed by absolute path, mtime and sha1 of the workbook: an unchanged mtime is trusted,
+       a changed mtime with identical content only refreshes the cache metadata.'''
+    path = os.path.abspath(file)
+    stat = os.stat(path)
+    folder = os.path.join(os.path.dirname(path), cache_dir)
+    key = hashlib.sha1(path.encode('utf-8')).hexdigest()[:12]
+    cache = os.path.join(folder, '{}-{}.npz'.format(os.path.basename(path), key))
+    
+    digest = None
+    if os.path.exists(cache):
+        try:
+            frames, meta = load_frames(cache)
+        except (OSError, ValueError, KeyError):
+            frames, meta = {}, {}
+        if meta.get('path') == path and all(s in frames for s in sheets):
+            if meta.get('mtime') == stat.st_mtime and meta.get('size') == stat.st_size:
+                return {s: frames[s] for s in sheets}
+            digest = file_digest(path)
+            if meta.get('sha1') == digest:
+                meta['mtime'], meta['size'] = stat.st_mtime, stat.st_size
+                try:
+                    save_frames(cache, frames, meta)
+                except OSError:
+                    pass
+                return {s: frames[s] for s in sheets}
+    
+    xl = pd.ExcelFile(path)
+    frames = {s: xl.parse(s, index_col = index_col) for s in sheets}
+    meta = {'path': path, 'mtime': stat.st_mtime, 'size': stat.st_size,
+            'sha1': digest if digest is not None else file_digest(path)}
+    try:
+        os.makedirs(folder, exist_ok = True)
+        save_frames(cache, frames, meta)
+    except OSError:
+        #a read-only data folder only costs the speed-up, never the data
+        pass
+    return frames
+
+
 def rand_weights(n):
     '''vector of n random weights that sum up to 1'''
     k = np.random.rand(n)
@@ -91,25 +779,78 @@ def rand_weights(n):
 
 def PF_variance(w, S):
     '''Calculate Portfolio Variance'''
-    if len(w.shape)==1:
-        w = np.asmatrix(w).T
-    pf_var = np.dot(w.T, np.dot(S, w))
-    return float(pf_var)
+    return PF_variance_nd(w, S)
 
 def PF_volatility(w, S):
     '''Calculate Portfolio Standard Deviation'''
-    S_PF = np.sqrt(PF_variance(w,S))
-    return float(S_PF)
+    return PF_volatility_nd(w, S)
 
  
 def PF_return(w, r):
     '''calculate mean portfolio return'''
-    if len(w.shape)==1:
-        w = np.asmatrix(w).T
-    if len(r.shape) == 1:
-        r = np.asmatrix(r).T
-    R_PF = np.dot(w.T, r)
-    return float(R_PF)
+    return PF_return_nd(w, r)
+
+
+# ndarray portfolio kernels: no np.matrix conversion, a weight vector (N,) (or column (N, 1)) gives a float,
+# a (K, N) matrix of K weight vectors gives one value per row, written into out if given
+
+def _as_weights(w):
+    '''weights as ndarray, (N,) for one vector (a column vector is flattened), (K, N) for K vectors'''
+    w = np.asarray(w, dtype = np.float64)
+    if w.ndim == 2 and w.shape[1] == 1:
+        return w[:, 0]
+    return w
+
+def quad_form(W, S, out = None):
+    '''x'Sx for every row x of W (K, N) with one matmul, shape (K,)'''
+    W = np.asarray(W, dtype = np.float64)
+    return np.einsum('kn,kn->k', np.matmul(W, np.asarray(S)), W, out = out)
+
+def PF_variance_nd(w, S, out = None):
+    '''Portfolio Variance w'Sw'''
+    w = _as_weights(w)
+    if w.ndim == 1:
+        return float(np.dot(w, np.dot(np.asarray(S), w)))
+    return quad_form(w, S, out)
+
+def PF_volatility_nd(w, S, out = None):
+    '''Portfolio Standard Deviation'''
+    var = PF_variance_nd(w, S, out)
+    if np.ndim(var) == 0:
+        return float(np.sqrt(var))
+    return np.sqrt(var, out = var)
+
+def PF_return_nd(w, r, out = None):
+    '''mean portfolio return w'r'''
+    w = _as_weights(w)
+    r = np.asarray(r, dtype = np.float64).reshape(-1)
+    if w.ndim == 1:
+        return float(np.dot(w, r))
+    return np.dot(w, r, out = out)
+
+def box_nd(x, S, y, out = None):
+    '''x'Sy, row by row when x or y hold several vectors'''
+    x, y, S = _as_weights(x), _as_weights(y), np.asarray(S)
+    if x.ndim == 1 and y.ndim == 1:
+        return float(np.dot(x, np.dot(S, y)))
+    return np.einsum('...n,...n->...', np.matmul(x, S), y, out = out)
+
+def risk_contribution_nd(w, S, out = None):
+    '''asset contribution to total risk w * Sw / sqrt(w'Sw), shape of w'''
+    w = _as_weights(w)
+    MRC = np.matmul(w, np.asarray(S))
+    sigmapf = np.sqrt(np.einsum('...n,...n->...', MRC, w))
+    out = np.multiply(w, MRC, out = out)
+    out /= np.asarray(sigmapf)[..., None]
+    return out
+
+def turnover_nd(weights_t_0, return_t, weights_t_1, out = None):
+    '''sum of |w_1 - w_0 (1 + r)|, the weights w_0 drifted with the returns of the period'''
+    w0, w1, r = _as_weights(weights_t_0), _as_weights(weights_t_1), _as_weights(return_t)
+    diff = np.abs(w1 - w0 * (1. + r))
+    if diff.ndim == 1:
+        return float(diff.sum())
+    return diff.sum(axis = -1, out = out)
 
 def PF_return_risky_rf(w_risky, w_portfolio, mean_risky, rf):
     '''calculate mean portfolio return for portfolio with risk-free asset'''
@@ -153,34 +894,48 @@ def portfolioReturnOutOfSample(weights, returns):
     return retAssets.sum()
 
 
+#date formats tried, in order, when reading weight files
+DATE_FORMATS = ["%Y-%m-%d", "%d/%m/%Y", "%Y-%m-%d %H:%M:%S"]
+
+
+def infer_date_format(sample, formats = DATE_FORMATS):
+    '''first format of the list that parses every string in sample, None if there is none'''
+    for fmt in formats:
+        try:
+            for x in sample:
+                datetime.strptime(str(x), fmt)
+        except ValueError:
+            continue
+        return fmt
+    return None
+
+
+def read_weights_csv(name, sep = ',', index_col = 0, dtype = None, as_date = False, sample_size = 5):
+    '''Read a csv file with a date index (e.g. portfolio weights) into a dataframe.
+       The date format is inferred from the first rows and the whole index is parsed in one vectorised call;
+       dtype = np.float32 halves the memory of the values, as_date = True gives datetime.date labels.'''
+    df = pd.read_csv(name, sep = sep, index_col = index_col)
+    fmt = infer_date_format(df.index.values[:sample_size])
+    dates = pd.to_datetime(df.index, format = fmt)
+    df.index = dates.date if as_date else dates
+    if dtype is not None:
+        df = df.astype(dtype, copy = False)
+    return df
+
+
 def convertCSV_toDataframe(name, sep = ',', index_col = 0):
-        
-    df = pd.read_csv(name, sep = ',', index_col = 0)
-    dates = [datetime.strptime(df.index.values[i], "%Y-%m-%d") for i in range(len(df.index.values))]
-    indices = df.columns.values.tolist()
     
-    return pd.DataFrame(df.values, index = dates, columns = indices)
+    return read_weights_csv(name, sep = sep, index_col = index_col)
 
 
 def convertCSV_toDataframeTEST(name, sep = ',', index_col = 0):
     
-    df = pd.read_csv(name, sep = ',', index_col = 0)
-    try:
-        dates = [datetime.strptime(df.index.values[i], "%Y-%m-%d") for i in range(len(df.index.values))]
-    except ValueError:
-        dates = [datetime.strptime(df.index.values[i], "%d/%m/%Y") for i in range(len(df.index.values))]
-    indices = df.columns.values.tolist()
-    
-    return pd.DataFrame(df.values, index = dates, columns = indices)
+    return read_weights_csv(name, sep = sep, index_col = index_col)
 
 
 def convertCSV_toDataframe_to_date(name, sep = ',', index_col = 0):
     
-    df = pd.read_csv(name, sep = ',', index_col = 0)
-    dates = [datetime.strptime(df.index.values[i], "%Y-%m-%d").date() for i in range(len(df.index.values))]
-    indices = df.columns.values.tolist()
-    
-    return pd.DataFrame(df.values, index = dates, columns = indices)
+    return read_weights_csv(name, sep = sep, index_col = index_col, as_date = True)
 
  
     
@@ -209,12 +964,11 @@ def cov2cor(X):
     return R
 
 def cov_robust(X):
-    oas = sklearn.covariance.OAS()
-    oas.fit(X)
-    return pd.DataFrame(oas.covariance_, index=X.columns, columns=X.columns).values
+    '''OAS shrunk covariance matrix'''
+    return oas(np.asarray(X, dtype = np.float64))[0]
     
 def corr_robust(X):
-    cov = cov_robust(X).values
+    cov = cov_robust(X)
     shrunk_corr = cov2cor(cov)
     return pd.DataFrame(shrunk_corr, index=X.columns, columns=X.columns)
 
@@ -224,6 +978,112 @@ def is_pos_def(x):
 
 
 
+# #############################################################################
+
+# Weight storage
+
+# #############################################################################
+
+
+class WeightStore(object):
+    '''Directory of weight blocks (one .npz and a json sidecar per strategy setting).
+       Blocks are keyed by (strategy, years, gamma, epsilon, short) or looked up by label, e.g. the old csv name.'''
+
+    def __init__(self, root):
+        self.root = root
+        if not os.path.exists(root):
+            os.makedirs(root)
+        self.refresh()
+
+    def refresh(self):
+        '''rebuild the index from the sidecars on disk, picking up blocks written by other processes'''
+        index = {}
+        for name in os.listdir(self.root):
+            if name.endswith('.npz.json'):
+                entry = self._read_entry(name[:-len('.npz.json')])
+                if entry is not None:
+                    index[name[:-len('.npz.json')]] = entry
+        self.index = index
+        self.labels = {entry['label']: key for key, entry in self.index.items() if entry['label'] is not None}
+
+    @staticmethod
+    def key(strategy, years, gamma = None, epsilon = None, short = True):
+        '''index key of a strategy setting'''
+        return '{}_M{}_gamma{}_epsilon{}_{}'.format(strategy, years,
+                                                  '-' if gamma is None else '{:3.1f}'.format(gamma),
+                                                  '-' if epsilon is None else '{:3.1f}'.format(epsilon),
+                                                  'short' if short else 'noshort')
+
+    def _lookup(self, label):
+        '''key of a key or label, refreshing the index once if it is unknown'''
+        if label not in self.labels and label not in self.index:
+            self.refresh()
+        return self.labels.get(label, label)
+
+    def __contains__(self, label):
+        return self._lookup(label) in self.index
+
+    def _sidecar(self, key):
+        return os.path.join(self.root, key + '.npz.json')
+
+    def _read_entry(self, key):
+        try:
+            with open(self._sidecar(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_entry(self, key, entry):
+        path = self._sidecar(key)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(entry, f, indent = 1, sort_keys = True)
+        os.replace(tmp, path)
+
+    def append(self, weights, strategy, years, gamma = None, epsilon = None, short = True, label = None):
+        '''add a block of weights (dates x assets); rows of already stored dates are overwritten'''
+        key = self.key(strategy, years, gamma, epsilon, short)
+        path = os.path.join(self.root, key + '.npz')
+        weights = pd.DataFrame(weights)
+        weights.index = pd.to_datetime(weights.index)
+        if os.path.exists(path):
+            stored = load_frames(path)[0]['weights']
+            weights = pd.concat([stored, weights])
+            weights = weights[~weights.index.duplicated(keep = 'last')].sort_index()
+        save_frames(path, {'weights': weights})
+
+        entry = self._read_entry(key) or self.index.get(key, {'label': None})
+        entry.update({'file': key + '.npz', 'strategy': strategy, 'years': years, 'gamma': gamma,
+                      'epsilon': epsilon, 'short': short,
+                      'start': str(weights.index[0].date()), 'end': str(weights.index[-1].date())})
+        if label is not None:
+            entry['label'] = label
+            self.labels[label] = key
+        self._write_entry(key, entry)
+        self.index[key] = entry
+
+    def info(self, label):
+        '''index entry (strategy, years, gamma, epsilon, short, ...) of a key or label'''
+        return self.index[self._lookup(label)]
+
+    def read_label(self, label, start = None, end = None):
+        '''weight matrix stored under a key or label, sliced to [start, end]'''
+        entry = self.info(label)
+        weights = load_frames(os.path.join(self.root, entry['file']))[0]['weights']
+        return weights.loc[start:end]
+
+    def read(self, strategy, years, gamma = None, epsilon = None, short = True, start = None, end = None):
+        '''weight matrix of a strategy setting, sliced to [start, end]'''
+        return self.read_label(self.key(strategy, years, gamma, epsilon, short), start, end)
+
+    def entries(self, **filters):
+        '''index entries matching all the given fields, e.g. store.entries(strategy = 'GUW', years = 10)'''
+        self.refresh()
+        return [entry for key, entry in sorted(self.index.items())
+                if all(entry.get(field) == value for field, value in filters.items())]
+
+
+
 
 
 # #############################################################################
@@ -233,48 +1093,212 @@ def is_pos_def(x):
 # #############################################################################
 
 
+def solve_guarded(Sigma, b, tol = 1e-4, exact = None):
+    '''Sigma^-1 b for a stack Sigma (W, N, N), solved in the dtype of Sigma.
+       float32 windows whose estimated condition number exceeds tol / eps32 are solved again in float64,
+       from exact(indices) if given. Returns the solution (float64) and the mask of those windows.'''
+    vector = np.ndim(b) == Sigma.ndim - 1
+    b = np.asarray(b, dtype = np.float64)
+    if vector:
+        b = b[..., None]
+    fallback = np.zeros(len(Sigma), dtype = bool)
+    if Sigma.dtype == np.float64:
+        x = np.linalg.solve(Sigma, b)
+    else:
+        potrf, pocon, potrs = get_lapack_funcs(('potrf', 'pocon', 'potrs'), (Sigma[:1],))
+        eps = np.finfo(Sigma.dtype).eps
+        #1-norm of every window, the condition estimate is relative to it
+        anorm = np.abs(Sigma).sum(axis = -2).max(axis = -1)
+        b32 = b.astype(Sigma.dtype)
+        x = np.empty(b.shape)
+        for w in range(len(Sigma)):
+            factor, info = potrf(Sigma[w])
+            if info == 0:
+                rcond, info = pocon(factor, anorm[w])
+            if info != 0 or eps > tol * rcond:
+                fallback[w] = True
+                continue
+            x[w] = potrs(factor, b32[w])[0]
+        if fallback.any():
+            idx = np.flatnonzero(fallback)
+            S64 = exact(idx) if exact is not None else Sigma[idx].astype(np.float64)
+            x[idx] = np.linalg.solve(S64, b[idx])
+    return (x[..., 0] if vector else x), fallback
+
+
+class MomentSummary(object):
+    '''Mean and covariance of one window (or a stack of windows) with Sigma factorised once and
+       Sigma^-1 1, Sigma^-1 mu, A, B, C, D cached; the allocators accept it in place of mu.
+       float32 stacks are solved through solve_guarded, fallback flags the windows redone in float64.'''
+
+    def __init__(self, mu, Sigma, precision = None, tol = 1e-4, exact = None):
+        self.mu = mu
+        if Sigma is not None:
+            Sigma = np.asarray(Sigma)
+            if not (Sigma.ndim == 3 and Sigma.dtype == np.float32):
+                Sigma = Sigma.astype(np.float64, copy = False)
+        self.Sigma = Sigma
+        self.tol = tol
+        self.exact = exact
+        self.fallback = None
+        self._precision = None if precision is None else np.asarray(precision, dtype = np.float64)
+        if self.Sigma is None and self._precision is None:
+            raise ValueError('MomentSummary needs Sigma or its precision matrix')
+        self.batched = (self.Sigma if self.Sigma is not None else self._precision).ndim == 3
+        self.nAssets = (self.Sigma if self.Sigma is not None else self._precision).shape[-1]
+        self._factor = None
+        self._cache = {}
+
+    @property
+    def factor(self):
+        '''Cholesky factor of Sigma (scipy cho_factor), a single window only'''
+        if self._factor is None:
+            self._factor = cho_factor(self.Sigma)
+        return self._factor
+
+    def solve(self, b):
+        '''Sigma^-1 b for a vector b (N,), or (W, N) for a stack'''
+        b = np.asarray(b, dtype = np.float64)
+        if self._precision is not None:
+            return np.matmul(self._precision, b[..., None])[..., 0]
+        if self.batched:
+            return self._solve_stack(b)
+        return cho_solve(self.factor, b)
+
+    def _solve_stack(self, b):
+        x, fallback = solve_guarded(self.Sigma, b, self.tol, self.exact)
+        self.fallback = fallback if self.fallback is None else self.fallback | fallback
+        return x
+
+    def _cached(self, key, compute):
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    @property
+    def mu_vec(self):
+        if self.mu is None:
+            raise ValueError('MomentSummary built without mean returns')
+        shape = (-1, self.nAssets) if self.batched else (self.nAssets,)
+        return self._cached('mu', lambda: np.asarray(self.mu, dtype = np.float64).reshape(shape))
+
+    @property
+    def precision(self):
+        if self._precision is None:
+            eye = np.broadcast_to(np.eye(self.nAssets), np.shape(self.Sigma))
+            self._precision = (self._solve_stack(eye) if self.batched
+                               else cho_solve(self.factor, np.eye(self.nAssets)))
+        return self._precision
+
+    @property
+    def inv_ones(self):
+        shape = np.shape(self.Sigma if self.Sigma is not None else self._precision)[:-1]
+        return self._cached('inv_ones', lambda: self.solve(np.ones(shape)))
+
+    @property
+    def inv_mu(self):
+        if self.batched and self._precision is None and not self._cache.keys() & {'inv_mu', 'inv_ones'}:
+            #both right hand sides in one stacked solve
+            both = self._solve_stack(np.stack([self.mu_vec, np.ones_like(self.mu_vec)], axis = -1))
+            self._cache['inv_mu'], self._cache['inv_ones'] = both[..., 0], both[..., 1]
+        return self._cached('inv_mu', lambda: self.solve(self.mu_vec))
+
+    @property
+    def A(self):
+        return self._cached('A', lambda: self._scalar((self.mu_vec * self.inv_mu).sum(axis = -1)))
+
+    @property
+    def B(self):
+        return self._cached('B', lambda: self._scalar(self.inv_mu.sum(axis = -1)))
+
+    @property
+    def C(self):
+        return self._cached('C', lambda: self._scalar(self.inv_ones.sum(axis = -1)))
+
+    @property
+    def D(self):
+        return self.A * self.C - self.B ** 2
+
+    def _scalar(self, x):
+        return x if self.batched else float(x)
+
+    def excess(self, rf):
+        '''summary of the excess returns mu - rf, sharing the factorisation'''
+        if self.batched:
+            rf = np.asarray(rf, dtype = np.float64)[..., None]
+        #solve (and factorise) before copying, so that the factor is shared
+        inv_ones = self.inv_ones
+        other = MomentSummary.__new__(MomentSummary)
+        other.__dict__.update(self.__dict__)
+        other.mu = self.mu - rf
+        other._cache = {'inv_ones': inv_ones}
+        if 'inv_mu' in self._cache:
+            other._cache['inv_mu'] = self.inv_mu - rf * self.inv_ones
+        return other
+
+    def shrink(self, intensity, target):
+        '''summary of the mean (1 - intensity) mu + intensity target 1, sharing the factorisation;
+           intensity and target are scalars, or one value per window for a stack'''
+        intensity, target = np.asarray(intensity, dtype = np.float64), np.asarray(target, dtype = np.float64)
+        if self.batched:
+            intensity, target = intensity[..., None], target[..., None]
+        else:
+            intensity, target = float(intensity), float(target)
+        #solve (and factorise) before copying, so that the factor is shared
+        inv_ones, inv_mu = self.inv_ones, self.inv_mu
+        other = MomentSummary.__new__(MomentSummary)
+        other.__dict__.update(self.__dict__)
+        other.mu = (1. - intensity) * self.mu + intensity * target * np.ones_like(self.mu)
+        other._cache = {'inv_ones': inv_ones,
+                        'inv_mu': (1. - intensity) * inv_mu + intensity * target * inv_ones}
+        return other
+
+    def like_mu(self, x):
+        '''a vector computed from the summary, shaped (and typed) like mu, i.e. like np.dot(Sigma^-1, mu)'''
+        if isinstance(self.mu, np.matrix):
+            return np.asmatrix(x).reshape(self.mu.shape)
+        if np.ndim(self.mu) == 2 and not self.batched:
+            return np.reshape(x, np.shape(self.mu))
+        return np.asarray(x)
+
+
+def _as_summary(mu, Sigma = None, invSigma = None):
+    '''MomentSummary handed in place of mu (or of Sigma), otherwise one built from (mu, Sigma)'''
+    if isinstance(mu, MomentSummary):
+        return mu
+    if isinstance(Sigma, MomentSummary):
+        return Sigma
+    return MomentSummary(mu, Sigma, invSigma)
+
+
 def weight_risky_assets(pf_ret, rf, pf_sigma, gamma):
     return (pf_ret - rf)/(gamma * pf_sigma ** 2)
 
 #define function to calculate A,B,C,D (Munk)
-def var_all(mu,Sigma):
-    varall = np.array([var_A(mu, Sigma),
-                      var_B(mu, Sigma),
-                      var_C(Sigma),
-                      var_D(mu, Sigma)])
+def var_all(mu, Sigma = None):
+    m = _as_summary(mu, Sigma)
+    varall = np.array([m.A,
+                      m.B,
+                      m.C,
+                      m.D])
     return varall
 
-def var_A(mu, Sigma):
-    if len(mu.shape)==1:
-        mu = np.asmatrix(mu).T
-    varA = np.dot(mu.T, np.dot(mat_inv(Sigma), mu))
-    return float(varA)
-
-def var_B(mu, Sigma):
-    if len(mu.shape)==1:
-        mu = np.asmatrix(mu).T
-    ones = np.asmatrix(np.ones(Sigma.shape[0])).T
-    varB = np.dot(ones.T, np.dot(mat_inv(Sigma), mu))
-    return float(varB)
-
-def var_C(Sigma):
-    ones = np.asmatrix(np.ones(Sigma.shape[0])).T
-    varC = np.dot(ones.T, np.dot(mat_inv(Sigma), ones))
-    return float(varC)
-
-def var_D(mu, Sigma):
-    varA = var_A(mu, Sigma)
-    varB = var_B(mu, Sigma)
-    varC = var_C(Sigma)
-    varD = varA * varC - varB ** 2
-    return float(varD)
+def var_A(mu, Sigma = None, *, invSigma = None):
+    return _as_summary(mu, Sigma, invSigma).A
+
+def var_B(mu, Sigma = None, *, invSigma = None):
+    return _as_summary(mu, Sigma, invSigma).B
+
+def var_C(Sigma, *, invSigma = None):
+    return _as_summary(None, Sigma, invSigma).C
+
+def var_D(mu, Sigma = None, *, invSigma = None):
+    return _as_summary(mu, Sigma, invSigma).D
 
 
-def meanVarPF_one_fund(meanRet, varCovar, gamma):
-    first = mat_inv(varCovar)
-    second = meanRet - (var_B(meanRet, varCovar)-gamma)/var_C(varCovar)
-    meanVarWeights = np.array(np.multiply(1. / gamma,
-                              np.dot(first, second)))
+def meanVarPF_one_fund(meanRet, varCovar, gamma, *, invSigma = None):
+    m = _as_summary(meanRet, varCovar, invSigma)
+    meanVarWeights = np.array(m.like_mu((m.inv_mu - (m.B - gamma) / m.C * m.inv_ones) / gamma))
     return meanVarWeights
 
 def meanVarPF_one_fund_noshort(meanRet, varCovar, gamma):
@@ -294,8 +1318,8 @@ def meanVar_objective(x, args):
     meanRet = args[0]
     varCovar = args[1]
     gamma = float(args[2])
-    mu = PF_return(x, meanRet)
-    sigma = PF_volatility(x, varCovar)
+    mu = PF_return_nd(x, meanRet)
+    sigma = PF_volatility_nd(x, varCovar)
     J = - utility_MV(mu, sigma, gamma)
     return J
 
@@ -305,16 +1329,16 @@ def minVarPF(returns):
     weights = 1 / (var_C(estSigma)) * np.dot(mat_inv(estSigma), oneVector)
     return weights
 
-def minVarPF1(varCovar):
-    oneVector = np.ones(varCovar.shape[0])
-    weights = np.array(np.multiply(1 / (var_C(varCovar)), np.dot(mat_inv(varCovar), oneVector)))
+def minVarPF1(varCovar, *, invSigma = None):
+    m = _as_summary(None, varCovar, invSigma)
+    weights = np.array(m.inv_ones / m.C)
     return weights.T
 
 def minVarPF_noshort(varCovar):
     cons = ({'type': 'ineq', 'fun': long_only_constraint},{'type' : 'eq', 'fun' : weight_constraint })
     nAssets = varCovar.shape[0]
     w_0 = rand_weights(nAssets)
-    res = minimize(PF_variance,
+    res = minimize(PF_variance_nd,
                    w_0,
                    varCovar,
                    method = 'SLSQP',
@@ -334,16 +1358,13 @@ def maxSRPF(returns, rf):
                        (meanRet - rf)))
     return weights
 
-def maxSRPF1(meanRet, varCovar, rf):
+def maxSRPF1(meanRet, varCovar, rf, *, invSigma = None):
     #meanRet and varCovar are the expected return and variance covariance matrix of simple returns (NOT EXCESS R.)
     #the output is the fraction invested on each single risky asset (they sum to one)
+    m = _as_summary(meanRet, varCovar, invSigma)
     rf = np.float(rf)
-    varB = np.float(var_B(meanRet, varCovar))
-    varC = np.float(var_C(varCovar))
-    weights = np.array(np.float(1 / (varB - varC * rf))* 
-                       np.dot(mat_inv(varCovar), 
-                       np.array(meanRet - (rf))).T)
-    return weights.T
+    weights = np.array(m.like_mu((m.inv_mu - rf * m.inv_ones) / (m.B - m.C * rf)))
+    return weights
 
 def maxSRPF_noshort(meanRet, varCovar, rf):
     cons = ({'type': 'ineq', 'fun': long_only_constraint},{'type' : 'eq', 'fun' : weight_constraint })
@@ -362,42 +1383,106 @@ def SR_objective(x, args):
     meanRet = args[0]
     varCovar = args[1]
     rf = args[2]
-    r_p = np.dot(x.T, meanRet)
-    sigma_p = np.sqrt(PF_variance(x, varCovar))
+    r_p = PF_return_nd(x, meanRet)
+    sigma_p = PF_volatility_nd(x, varCovar)
     SR = (r_p-rf)/sigma_p
     return -SR
 
-def tangWeights(meanExcRet, varCovarExcRet, gamma):
+def tangWeights(meanExcRet, varCovarExcRet, gamma, *, invSigma = None):
     #both meanExcRet and varCovar refer to excess returns
     #the output is the weight on each single risky asset. Risk free weight = 1 - weights.sum()
-    weights = 1 / (gamma) * np.dot(mat_inv(varCovarExcRet), meanExcRet)
+    m = _as_summary(meanExcRet, varCovarExcRet, invSigma)
+    weights = 1 / (gamma) * m.like_mu(m.inv_mu)
     return weights
 
-def maxSlopePortfolio(meanRet, varCovarMatrix):
-    return 1 / var_B(meanRet, varCovarMatrix) * np.dot(mat_inv(varCovarMatrix), meanRet)  
+def maxSlopePortfolio(meanRet, varCovarMatrix, *, invSigma = None):
+    m = _as_summary(meanRet, varCovarMatrix, invSigma)
+    return 1 / m.B * m.like_mu(m.inv_mu)  
 
 def meanVarPF(meanRet, varCovar, m_bar):
-    A = var_A(mu, Sigma)
-    B = var_B(mu, Sigma)
-    C = var_C(Sigma)
-    D = varA * varC - varB ** 2
-    inv = mat_inv(varCovar)
-    ones = np.asmatrix(np.ones(len(meanRet))).T
-    pi = (C * m_bar - B) / D * np.dot(inv, meanRet) + (A - B * m_bar) / D * np.dot(inv, ones)
+    m = _as_summary(meanRet, varCovar)
+    pi = (m.C * m_bar - m.B) / m.D * m.like_mu(m.inv_mu) + (m.A - m.B * m_bar) / m.D * m.like_mu(m.inv_ones)
     return pi
 
-def threeFundSeparation(mu_hat, varCov, estLength, gamma, rf):
-    mu_hat_exc = mu_hat - rf
-    nAssets = len(mu_hat)
-    ones = np.asmatrix(np.ones(nAssets, dtype = float)).T    
+# batched variants: mu (W, N) and Sigma (W, N, N) (or a batched MomentSummary) for W windows at once,
+# the output is a (W, N) weight matrix, one row per window
+
+def _batch_summary(mu, Sigma = None, invSigma = None):
+    m = _as_summary(mu, Sigma, invSigma)
+    if not m.batched:
+        raise ValueError('batched allocators need stacks of windows: mu (W, N), Sigma (W, N, N)')
+    return m
+
+def _batch_column(x):
+    '''scalar or one value per window, as a column broadcasting against (W, N)'''
+    x = np.asarray(x, dtype = np.float64)
+    return x[..., None] if x.ndim else x
+
+def minVarPF_batch(varCovar, *, invSigma = None):
+    '''minVarPF1 for every window'''
+    m = _batch_summary(None, varCovar, invSigma)
+    return m.inv_ones / m.C[:, None]
+
+def maxSRPF_batch(meanRet, varCovar, rf, *, invSigma = None):
+    '''maxSRPF1 for every window, rf is a scalar or one rate per window'''
+    m = _batch_summary(meanRet, varCovar, invSigma)
+    rf = _batch_column(rf)
+    return (m.inv_mu - rf * m.inv_ones) / (m.B[:, None] - m.C[:, None] * rf)
+
+def tangWeights_batch(meanExcRet, varCovarExcRet, gamma, *, invSigma = None):
+    '''tangWeights for every window (excess returns)'''
+    m = _batch_summary(meanExcRet, varCovarExcRet, invSigma)
+    return m.inv_mu / gamma
+
+def meanVarPF_one_fund_batch(meanRet, varCovar, gamma, *, invSigma = None):
+    '''meanVarPF_one_fund for every window'''
+    m = _batch_summary(meanRet, varCovar, invSigma)
+    return (m.inv_mu - ((m.B - gamma) / m.C)[:, None] * m.inv_ones) / gamma
+
+def maxSlopePortfolio_batch(meanRet, varCovarMatrix, *, invSigma = None):
+    '''maxSlopePortfolio for every window'''
+    m = _batch_summary(meanRet, varCovarMatrix, invSigma)
+    return m.inv_mu / m.B[:, None]
+
+# mean shrinkage: summaries of shrunk mean returns for the allocators above, the intensity and the target
+# come from A, B, C of the summary, i.e. from the factorisation the allocators reuse, for all windows at once
+
+def bayes_stein_mean(meanRet, varCovar, estLength, *, invSigma = None):
+    '''Bayes-Stein mean of Jorion (1986): mu shrunk towards the mean return of the minimum variance portfolio
+       mu_0 = B / C with intensity w = (N + 2) / (N + 2 + T (mu - mu_0)' S^-1 (mu - mu_0)),
+       S = (T - 1) / (T - N - 2) Sigma. One window or a stack (meanRet (W, N), varCovar (W, N, N)).
+       Returns a summary of the shrunk mean (sharing the factorisation of Sigma), the intensity w and mu_0.'''
+    m = _as_summary(meanRet, varCovar, invSigma)
+    T = float(estLength)
+    N = float(m.nAssets)
+    target = m.B / m.C
+    #(mu - mu_0 1)' Sigma^-1 (mu - mu_0 1) = A - B^2 / C
+    distance = (m.A - m.B ** 2 / m.C) * (T - N - 2.) / (T - 1.)
+    intensity = (N + 2.) / (N + 2. + T * distance)
+    return m.shrink(intensity, target), intensity, target
+
+def james_stein_mean(meanRet, varCovar, estLength, *, invSigma = None):
+    '''James-Stein mean: mu shrunk towards the grand mean g (the average over the assets) with intensity
+       w = min(1, (N - 2) / (T (mu - g)' Sigma^-1 (mu - g))). One window or a stack.
+       Returns a summary of the shrunk mean (sharing the factorisation of Sigma), the intensity w and g.'''
+    m = _as_summary(meanRet, varCovar, invSigma)
+    T = float(estLength)
+    N = float(m.nAssets)
+    target = m.mu_vec.mean(axis = -1)
+    distance = m.A - 2. * target * m.B + target ** 2 * m.C
+    intensity = np.minimum(1., (N - 2.) / (T * distance))
+    if not m.batched:
+        target, intensity = float(target), float(intensity)
+    return m.shrink(intensity, target), intensity, target
+
+def _three_fund_direction(m, estLength):
+    '''the gamma-free part of the three-fund rule of Kan and Zhou for a summary of excess returns:
+       c_three and ratio_1 Sigma^-1 mu + ratio_2 mu_g Sigma^-1 1, per window for a batched summary'''
     T = float(estLength)
-    N = float(nAssets)
+    N = float(m.nAssets)
     c_three = ((T - N - 1.)*(T - N - 4.))/(T * (T - 2.))
-    covInv = np.linalg.inv(varCov)
-    mu_hat_g = ((np.dot(ones.T, np.dot(covInv, mu_hat_exc))
-                / np.dot(ones.T, np.dot(covInv, ones))))[0,0]
-    diff = mu_hat_exc - mu_hat_g
-    psi_hat_sq = float(np.dot(diff.T, np.dot(covInv, diff)))
+    mu_hat_g = m.B / m.C
+    psi_hat_sq = m.A - 2. * mu_hat_g * m.B + mu_hat_g ** 2 * m.C
 
     first = ((T - N - 1.) * psi_hat_sq - (N - 1.)) / T
     sec = (2. * (psi_hat_sq ** ((N - 1.)/2.)) 
@@ -412,51 +1497,45 @@ def threeFundSeparation(mu_hat, varCov, estLength, gamma, rf):
     psi_hat_sq_unbiased = first + sec / third
     ratio_1 =  psi_hat_sq_unbiased / (psi_hat_sq_unbiased + (N / T))
     ratio_2 = (N / T) / (psi_hat_sq_unbiased + (N / T))
+    if m.batched:
+        ratio_1, ratio_2, mu_hat_g = _batch_column(ratio_1), _batch_column(ratio_2), _batch_column(mu_hat_g)
     
-    weights_three_fund = ((c_three / gamma )  
-                         * ( ratio_1  * np.dot(covInv, mu_hat_exc) 
-                         + ratio_2 * mu_hat_g * np.dot(covInv, ones) ))
+    return c_three, ratio_1  * m.inv_mu + ratio_2 * mu_hat_g * m.inv_ones
+
+
+def threeFundSeparation(mu_hat, varCov, estLength, gamma, rf, *, invSigma = None):
+    m = _as_summary(mu_hat, varCov, invSigma).excess(rf)
+    c_three, direction = _three_fund_direction(m, estLength)
+    
+    weights_three_fund = (c_three / gamma ) * m.like_mu(direction)
     
 #    weights_scaled = weights_three_fund / weights_three_fund.sum() 
     
     return weights_three_fund
 
 
-def threeFundSeparationEMP(mu_hat_exc, varCov, estLength, gamma):
-    
-    nAssets = len(mu_hat_exc)
-    ones = np.asmatrix(np.ones(nAssets, dtype = float)).T    
-    T = float(estLength)
-    N = float(nAssets)
-    c_three = ((T - N - 1.)*(T - N - 4.))/(T * (T - 2.))
-    covInv = np.linalg.inv(varCov)
-    mu_hat_g = ((np.dot(ones.T, np.dot(covInv, mu_hat_exc))
-                / np.dot(ones.T, np.dot(covInv, ones))))[0,0]
-    diff = mu_hat_exc - mu_hat_g
-    psi_hat_sq = float(np.dot(diff.T, np.dot(covInv, diff)))
-
-    first = ((T - N - 1.) * psi_hat_sq - (N - 1.)) / T
-    sec = (2. * (psi_hat_sq ** ((N - 1.)/2.)) 
-            * ((1. + psi_hat_sq) ** (- (T - 2.) / 2.)))
-
-    up_limit = psi_hat_sq / (1. + psi_hat_sq)
-    a = (N - 1.) / 2.
-    b = (T - N + 1.) / 2.
-    integration = special.betainc(a, b, up_limit) * special.beta(a, b)
+def threeFundSeparationEMP(mu_hat_exc, varCov, estLength, gamma, *, invSigma = None):
     
-    third = T * integration
-    psi_hat_sq_unbiased = first + sec / third
-    ratio_1 =  psi_hat_sq_unbiased / (psi_hat_sq_unbiased + (N / T))
-    ratio_2 = (N / T) / (psi_hat_sq_unbiased + (N / T))
+    m = _as_summary(mu_hat_exc, varCov, invSigma)
+    c_three, direction = _three_fund_direction(m, estLength)
     
-    weights_three_fund = ((c_three / gamma )  
-                         * ( ratio_1  * np.dot(covInv, mu_hat_exc) 
-                         + ratio_2 * mu_hat_g * np.dot(covInv, ones) ))
+    weights_three_fund = (c_three / gamma ) * m.like_mu(direction)
     
 #    weights_scaled = weights_three_fund / weights_three_fund.sum() 
     
     return weights_three_fund
 
+
+def threeFund_batch(mu_hat_exc, varCov, estLength, gamma, *, invSigma = None):
+    '''threeFundSeparationEMP for every window (mu_hat_exc (W, N), varCov (W, N, N) or a batched MomentSummary)
+       and every risk aversion of a gamma list: the gamma-free part (psi^2, the incomplete beta integral,
+       the shrinkage ratios) is computed once per window, the gammas only scale it by c_three / gamma.
+       Returns a (gamma, window, asset) array.'''
+    m = _batch_summary(mu_hat_exc, varCov, invSigma)
+    c_three, direction = _three_fund_direction(m, estLength)
+    gamma = np.asarray(gamma, dtype = np.float64).reshape(-1, 1, 1)
+    return (c_three / gamma) * direction
+
 # #############################################################################
     
 # Garlappi, Uppal, Wang Portfolio Optimization
@@ -513,33 +1592,25 @@ def GWweights(returns, epsilon, gamma):
             * (mu - (B - gamma * (1 + np.sqrt(varepsilon)/(gamma * sigmap))) / C * ones))))
     return pi
 
-def GWweights1(returns, muRet, varcovar, epsilon, gamma):
+def GWweights1(returns, muRet, varcovar, epsilon, gamma, *, invSigma = None):
     '''calculates the optimal portfolio weights under Garlappi Wang assumptions'''
-    sigmap = optSigma1(returns, muRet, varcovar, epsilon, gamma)
-    invSigma = mat_inv(varcovar)
+    m = _as_summary(muRet, varcovar, invSigma)
+    sigmap = optSigma1(returns, m, None, epsilon, gamma)
     T, N = returns.shape
     varepsilon = epsilon * ((T - 1.) * N)/(T * (T - N))
-    B = var_B(muRet, varcovar)
-    C = var_C(varcovar)
-    ones = np.ones(varcovar.shape[0])
-    pi =  (np.dot(((1. / gamma) * invSigma) ,
-                    ((1. / (1. + np.sqrt(varepsilon)/(gamma * sigmap)))
-            * np.subtract(muRet, (B - gamma * (1 + np.sqrt(varepsilon)/(gamma * sigmap))) / C * ones)[:,0])))
+    k = 1. / (1. + np.sqrt(varepsilon)/(gamma * sigmap))
+    pi = m.like_mu(k / gamma * (m.inv_mu - (m.B - gamma / k) / m.C * m.inv_ones))[:, 0]
     return pi
 
 
-def GWweights1_and_PHI_aa(returns, muRet, varcovar, epsilon, gamma):
+def GWweights1_and_PHI_aa(returns, muRet, varcovar, epsilon, gamma, *, invSigma = None):
     '''calculates the optimal portfolio weights under Garlappi Wang assumptions'''
-    sigmap = optSigma2(returns, muRet, varcovar, epsilon, gamma)
-    invSigma = mat_inv(varcovar)
+    m = _as_summary(muRet, varcovar, invSigma)
+    sigmap = optSigma2(returns, m, None, epsilon, gamma)
     T, N = returns.shape
     varepsilon = epsilon * ((T - 1.) * N)/(T * (T - N))
-    B = var_B(muRet, varcovar)
-    C = var_C(varcovar)
-    ones = np.ones(varcovar.shape[0])
-    pi =  (np.dot(((1. / gamma) * invSigma) ,
-                    ((1. / (1. + np.sqrt(varepsilon)/(gamma * sigmap)))
-            * np.subtract(muRet, (B - gamma * (1 + np.sqrt(varepsilon)/(gamma * sigmap))) / C * ones)[:,0])))
+    k = 1. / (1. + np.sqrt(varepsilon)/(gamma * sigmap))
+    pi = m.like_mu(k / gamma * (m.inv_mu - (m.B - gamma / k) / m.C * m.inv_ones))[:, 0]
     
     numerator = float(np.sqrt(varepsilon))
     denominatorA = float(gamma * sigmap)
@@ -551,58 +1622,57 @@ def GWweights1_and_PHI_aa(returns, muRet, varcovar, epsilon, gamma):
 
 
 
-def GWweights2(returns, muRet, varcovar, epsilon, gamma):
+def GWweights2(returns, muRet, varcovar, epsilon, gamma, *, invSigma = None):
     '''calculates the optimal portfolio weights under Garlappi Wang assumptions'''
     T, N = returns.shape
-    sigmap = optSigma2(returns, muRet, varcovar, epsilon, gamma)
+    m = _as_summary(muRet, varcovar, invSigma)
+    sigmap = optSigma2(returns, m, None, epsilon, gamma)
     if sigmap == 10:
         pi = 10 * np.ones(N)
         return pi
     else:
-        invSigma = mat_inv(varcovar)
         varepsilon = epsilon * ((T - 1.) * N)/(T * (T - N))
-        B = var_B(muRet, varcovar)
-        C = var_C(varcovar)
-        ones = np.ones(varcovar.shape[0])
-        pi =  (np.dot(((1. / gamma) * invSigma) ,
-                        ((1. / (1. + np.sqrt(varepsilon)/(gamma * sigmap)))
-                * np.subtract(muRet, (B - gamma * (1 + np.sqrt(varepsilon)/(gamma * sigmap))) / C * ones)[:,0])))
+        k = 1. / (1. + np.sqrt(varepsilon)/(gamma * sigmap))
+        pi = m.like_mu(k / gamma * (m.inv_mu - (m.B - gamma / k) / m.C * m.inv_ones))[:, 0]
         return pi
 
-def GWweights3(returns, muRet, varcovar, epsilon, gamma):
+def GWweights3(returns, muRet, varcovar, epsilon, gamma, *, invSigma = None):
     '''calculates the optimal portfolio weights under Garlappi Wang assumptions'''
     T, N = returns.shape
-    sigmap = optSigma2(returns, muRet, varcovar, epsilon, gamma)
+    m = _as_summary(muRet, varcovar, invSigma)
+    sigmap = optSigma2(returns, m, None, epsilon, gamma)
     if sigmap == 10:
         pi = 10 * np.ones(N)
         return pi
     else:
-        invSigma = mat_inv(varcovar)
         varepsilon = epsilon * ((T - 1.) * N)/(T * (T - N))
-        B = var_B(muRet, varcovar)
-        C = var_C(varcovar)
-        ones = np.ones(varcovar.shape[0])
-        pi =  (np.dot(((1. / gamma) * invSigma) ,
-                        ((1. / (1. + np.sqrt(varepsilon)/(gamma * sigmap)))
-                * np.subtract(muRet, (B - gamma * (1 + np.sqrt(varepsilon)/(gamma * sigmap))) / C * ones))))
+        k = 1. / (1. + np.sqrt(varepsilon)/(gamma * sigmap))
+        pi = m.like_mu(k / gamma * (m.inv_mu - (m.B - gamma / k) / m.C * m.inv_ones))
         return pi
 
 
 
 
-def GWweights_noshort(returns, meanRet, varCovar, epsilon, gamma):
-    cons = ({'type': 'ineq', 'fun': long_only_constraint},
-            {'type' : 'eq', 'fun' : weight_constraint })
+def GWweights_noshort(returns, meanRet, varCovar, epsilon, gamma, w_0 = None, full_output = False, ftol = 1e-8):
+    '''long-only Garlappi Wang weights, SLSQP on GW_objective with its exact gradient GW_gradient;
+       w_0 is the starting point (default: random weights), full_output = True also returns the
+       scipy OptimizeResult (success, status, nit, message)'''
+    cons = ({'type' : 'eq', 'fun' : weight_constraint, 'jac' : weight_constraint_jac },)
     estLength = returns.shape[0]
     nAssets = returns.shape[1]
-    w_0 = rand_weights(nAssets)
+    if w_0 is None:
+        w_0 = rand_weights(nAssets)
     res = minimize(GW_objective,
-                   w_0,
+                   _as_weights(w_0),
                    args = [meanRet, varCovar, gamma, epsilon, estLength, nAssets],
                    method = 'SLSQP',
+                   jac = GW_gradient,
+                   bounds = [(0., None)] * nAssets,
                    constraints = cons,
-                   options={'ftol': 1e-8, 'maxiter' : 50, 'disp' : False})
+                   options={'ftol': ftol, 'maxiter' : 50, 'disp' : False})
     weights = np.asmatrix(res.x).T
+    if full_output:
+        return weights, res
     return weights
 
 def GW_objective(x, args):
@@ -614,17 +1684,64 @@ def GW_objective(x, args):
     N = float(args[5])
     vareps = epsilon * ((T - 1) * N) / (T * (T - N))
     
-    r_p = np.dot(x.T,meanRet)
-    sigma_p = np.sqrt(PF_variance(x, varCovar))
+    r_p = PF_return_nd(x, meanRet)
+    sigma_p = PF_volatility_nd(x, varCovar)
     
     first = r_p 
     second = - gamma / 2 * sigma_p ** 2 * (1 + (2 * np.sqrt(vareps)) / 
                                            (gamma * sigma_p))
     objective = first + second
     return -objective
+
+def GW_gradient(x, args):
+    '''gradient of GW_objective: - (mu - gamma Sigma x - sqrt(vareps) Sigma x / sigma_p)'''
+    meanRet = np.asarray(args[0], dtype = np.float64).reshape(-1)
+    varCovar = np.asarray(args[1])
+    gamma = float(args[2])
+    T = float(args[4])
+    N = float(args[5])
+    vareps = args[3] * ((T - 1) * N) / (T * (T - N))
     
+    Sx = np.dot(varCovar, x)
+    sigma_p = np.sqrt(np.dot(x, Sx))
+    return - (meanRet - (gamma + np.sqrt(vareps) / sigma_p) * Sx)
+
+def weight_constraint_jac(x):
+    return np.ones_like(x)
+
+
+class GWNoShortPath(object):
+    '''GWweights_noshort along a rolling run: every solve starts from the previous solution (the previous
+       window, or the neighbouring epsilon / gamma of the same window, whichever was solved last), so that
+       SLSQP only has to follow the small change of the optimum. The convergence of every solve is kept.
+
+       EXAMPLE: path = GWNoShortPath()
+                for n in range(limit):
+                    weights = path.solve(rets, meanRet, estSigma, epsilon, gamma)
+                path.report()    # success, status, nit, message of every solve'''
+
+    def __init__(self, w_0 = None, ftol = 1e-10):
+        self.last = None if w_0 is None else _as_weights(w_0)
+        self.ftol = ftol
+        self.status = []
+
+    def solve(self, returns, meanRet, varCovar, epsilon, gamma, label = None):
+        '''GWweights_noshort warm-started from the last solution (equal weights for the first solve)'''
+        nAssets = returns.shape[1]
+        w_0 = self.last if self.last is not None else np.ones(nAssets) / nAssets
+        weights, res = GWweights_noshort(returns, meanRet, varCovar, epsilon, gamma, w_0 = w_0,
+                                         full_output = True, ftol = self.ftol)
+        if res.success:
+            self.last = res.x
+        self.status.append((label, bool(res.success), int(res.status), int(res.nit), res.message))
+        return weights
+
+    def report(self):
+        '''convergence of every solve, one row per call of solve'''
+        return pd.DataFrame(self.status, columns = ['label', 'success', 'status', 'nit', 'message'])
     
-def optSigma1(returns, muRet, varcovar, epsilon, gamma):
+    
+def optSigma1(returns, muRet, varcovar, epsilon, gamma, *, invSigma = None):
     '''needs to be called with from numpy.polynomial import Polynomial as poly '''
     '''calculate the root of the polynomial so that an optimal portfolio variance exists'''
     '''Input parameters: array of return data, ambiguity aversion = epsilon, risk aversion = gamma'''
@@ -633,9 +1750,10 @@ def optSigma1(returns, muRet, varcovar, epsilon, gamma):
     N = float(returns.shape[1])
     varepsilon = float(epsilon) * ((T - 1.) * N)/(T * (T - N))
     
-    C = var_C(varcovar)
-    B = var_B(muRet, varcovar)
-    A = var_A(muRet, varcovar)
+    m = _as_summary(muRet, varcovar, invSigma)
+    C = m.C
+    B = m.B
+    A = m.A
     
     equation = np.array([- varepsilon, - 2. * gamma * np.sqrt(varepsilon), 
           (C * varepsilon - A * C + B ** 2 - gamma ** 2), 
@@ -652,7 +1770,7 @@ def optSigma1(returns, muRet, varcovar, epsilon, gamma):
     else: 
         print("Polynomial does not yield any positive solution")
 
-def optSigma2(returns, muRet, varcovar, epsilon, gamma):
+def optSigma2(returns, muRet, varcovar, epsilon, gamma, *, invSigma = None):
     '''needs to be called with from numpy.polynomial import Polynomial as poly '''
     '''calculate the root of the polynomial so that an optimal portfolio variance exists'''
     '''Input parameters: array of return data, ambiguity aversion = epsilon, risk aversion = gamma'''
@@ -661,9 +1779,10 @@ def optSigma2(returns, muRet, varcovar, epsilon, gamma):
     N = float(returns.shape[1])
     varepsilon = float(epsilon) * ((T - 1.) * N)/(T * (T - N))
     
-    C = var_C(varcovar)
-    B = var_B(muRet, varcovar)
-    A = var_A(muRet, varcovar)
+    m = _as_summary(muRet, varcovar, invSigma)
+    C = m.C
+    B = m.B
+    A = m.A
     
     equation = np.array([- varepsilon, - 2. * gamma * np.sqrt(varepsilon), 
           (C * varepsilon - A * C + B ** 2 - gamma ** 2), 
@@ -687,23 +1806,146 @@ def optSigma2(returns, muRet, varcovar, epsilon, gamma):
 
 
     
-def varying_epsilon(exreturns, marketReturns, rf):
-    '''calculates a value of epsilon depending on Jensen's Alpha'''
-    alpha = []
-    X = marketReturns - rf
-    X1 = sm.add_constant(X)
-    y = exreturns
-    for i in range(exreturns.shape[1]):
-        model = sm.OLS(y[:,i], X1)
-        results = model.fit()
-        alpha.append(results.params[0])
-    np_alpha = np.array(alpha)
-    alpha_annualized = (1 + np_alpha) ** 12 - 1
-    MAD_alpha = np.mean(abs(alpha_annualized))
+def quartic_roots(coeffs):
+    '''roots of c0 + c1 x + c2 x^2 + c3 x^3 + c4 x^4 for every row of coeffs (K, 5) (lowest degree first,
+       as poly.polyroots), as the eigenvalues of K companion matrices in one batched call, shape (K, 4)'''
+    coeffs = np.asarray(coeffs, dtype = np.float64)
+    K = len(coeffs)
+    companion = np.zeros((K, 4, 4))
+    companion[:, np.arange(1, 4), np.arange(3)] = 1.
+    companion[:, :, -1] = - coeffs[:, :4] / coeffs[:, 4:]
+    return np.linalg.eigvals(companion)
+
+
+def optSigma_batch(A, B, C, varepsilon, gamma, tol = 1e-8, newton = 3):
+    '''optSigma1 for arrays of coefficients: A, B, C (Munk) of each window and varepsilon, gamma, broadcast
+       against each other (e.g. A[:, None, None], varepsilon[None, :, None], gamma[None, None, :] for a
+       windows x epsilon x gamma grid). All quartics are solved at once (batched companion eigenvalues),
+       the real roots are polished with a few Newton steps.
+       Only real positive roots are admissible. Returns sigma (the smallest admissible root, nan if there
+       is none) and two masks instead of the printed warnings: no_solution and multiple (more than one
+       admissible root), all with the broadcast shape.'''
+    A, B, C, varepsilon, gamma = np.broadcast_arrays(*[np.asarray(x, dtype = np.float64)
+                                                       for x in (A, B, C, varepsilon, gamma)])
+    shape = A.shape
+    root_ve = np.sqrt(varepsilon)
+    coeffs = np.stack([- varepsilon, - 2. * gamma * root_ve,
+                       C * varepsilon - A * C + B ** 2 - gamma ** 2,
+                       2. * C * gamma * root_ve,
+                       C * gamma ** 2], axis = -1).reshape(-1, 5)
+    roots = quartic_roots(coeffs)
+    
+    real = np.abs(roots.imag) <= tol * np.maximum(1., np.abs(roots))
+    x = roots.real.copy()
+    for _ in range(newton):
+        value = coeffs[:, 4:] + 0. * x
+        slope = np.zeros_like(x)
+        for k in (3, 2, 1, 0):
+            slope = slope * x + value
+            value = value * x + coeffs[:, k:k + 1]
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            step = np.where(real & (slope != 0), value / slope, 0.)
+        x = x - step
+    
+    admissible = real & (x > 0)
+    count = admissible.sum(axis = 1)
+    sigma = np.where(admissible, x, np.inf).min(axis = 1)
+    sigma[count == 0] = np.nan
+    return sigma.reshape(shape), (count == 0).reshape(shape), (count > 1).reshape(shape)
+
+
+def GWweights_grid(meanRet, varCovar, T, epsilon, gamma, *, invSigma = None):
+    '''GWweights1 for W windows of length T (meanRet (W, N), varCovar (W, N, N) or a batched MomentSummary)
+       over a whole grid of risk aversions gamma (G,) and ambiguity aversions epsilon (E,) at once.
+       The window moments are solved once, optSigma_batch gives sigma_p for every (gamma, epsilon, window),
+       and the weights are broadcast from Sigma^-1 mu and Sigma^-1 1: shape (G, E, W, N).
+       Windows where the quartic has no admissible root are nan; with several roots the smallest is taken.'''
+    m = _batch_summary(meanRet, varCovar, invSigma)
+    N = m.nAssets
+    gamma = np.asarray(gamma, dtype = np.float64).reshape(-1, 1, 1)
+    varepsilon = (np.asarray(epsilon, dtype = np.float64) * ((T - 1.) * N)/(T * (T - N))).reshape(1, -1, 1)
+    sigmap = optSigma_batch(m.A, m.B, m.C, varepsilon, gamma)[0]
+    k = 1. / (1. + np.sqrt(varepsilon)/(gamma * sigmap))
+    pi = (k / gamma)[..., None] * (m.inv_mu - ((m.B - gamma / k) / m.C)[..., None] * m.inv_ones)
+    return pi
+
+
+def guw_weight_cube(returns, years, gamma, epsilon, periods = 12, moments = None):
+    '''Garlappi Wang weights of the sweep years x gamma x epsilon, as the loops of Portfolios/Garlappi.py.
+       Returns the cube (years, gamma, epsilon, date, asset), the dates and the asset names;
+       longer estimation lengths are nan before their first window.'''
+    if moments is None:
+        moments = MomentIndex(returns)
+    T = len(moments)
+    lengths = [int(y * periods) for y in years]
+    first = min(lengths)
+    dates = returns.index[first - 1:T - 1]
+    cube = np.full((len(lengths), np.size(gamma), np.size(epsilon), len(dates), moments.sums.shape[1]), np.nan)
+    for i, estLength in enumerate(lengths):
+        starts = np.arange(T - estLength)
+        m = MomentSummary(moments.means(starts, estLength), moments.covs(starts, estLength, ddof = 1))
+        cube[i, :, :, estLength - first:] = GWweights_grid(m, None, estLength, epsilon, gamma)
+    return cube, dates, returns.columns
+
+
+def jensen_alpha(exreturns, marketReturns, rf = 0.):
+    '''Jensen's alpha and beta of every asset: the regressions of each column of exreturns (T, N) on a constant
+       and the market excess return marketReturns - rf, all assets in one least-squares solve.
+       The market is flattened to one regressor, (T,) or (T, 1) alike. Returns alpha (N,), beta (N,).'''
+    X = np.asarray(marketReturns, dtype = np.float64).reshape(-1) - np.asarray(rf, dtype = np.float64).reshape(-1)
+    X1 = np.column_stack([np.ones(len(X)), X])
+    params = np.linalg.lstsq(X1, np.asarray(exreturns, dtype = np.float64), rcond = None)[0]
+    return params[0], params[1]
+
+
+def rolling_jensen_alpha(exreturns, marketReturns, rf, length):
+    '''jensen_alpha of every rolling window exreturns[n:length+n] (rf aligned with the rows of the returns).
+       The 2 x 2 normal equations of a window are window sums (sum x, sum x^2, sum y, sum xy), taken as
+       differences of cumulative sums, i.e. one row added and one dropped per window; the data is shifted to
+       its full-sample mean first against cancellation. Returns alpha and beta (W, N), W = T - length + 1,
+       as DataFrames indexed by the last date of each window when exreturns is a DataFrame.'''
+    y = np.asarray(exreturns, dtype = np.float64)
+    x = np.asarray(marketReturns, dtype = np.float64).reshape(-1) - np.asarray(rf, dtype = np.float64).reshape(-1)
+    x0, y0 = x.mean(), y.mean(axis = 0)
+    xc, yc = x - x0, y - y0
+    
+    def window_sums(a):
+        c = np.concatenate([np.zeros((1,) + a.shape[1:]), np.cumsum(a, axis = 0)])
+        return c[length:] - c[:-length]
+    
+    Sx, Sxx = window_sums(xc), window_sums(xc ** 2)
+    Sy, Sxy = window_sums(yc), window_sums(xc[:, None] * yc)
+    beta = (Sxy - Sx[:, None] * Sy / length) / (Sxx - Sx ** 2 / length)[:, None]
+    alpha = Sy / length + y0 - beta * (Sx / length + x0)[:, None]
+    if isinstance(exreturns, pd.DataFrame):
+        dates = exreturns.index[length - 1:]
+        alpha = pd.DataFrame(alpha, index = dates, columns = exreturns.columns)
+        beta = pd.DataFrame(beta, index = dates, columns = exreturns.columns)
+    return alpha, beta
+
+
+def epsilon_from_alpha(alpha, periods = 12):
+    '''ambiguity aversion implied by Jensen's alphas: 25 x the mean absolute annualized alpha,
+       over the last axis (one value per window for an alpha panel)'''
+    alpha_annualized = (1 + np.asarray(alpha)) ** periods - 1
+    MAD_alpha = np.mean(abs(alpha_annualized), axis = -1)
     #    epsilon = 20 * np.tanh(15 * MAD_alpha)
     epsilon = 25 * MAD_alpha
+    if isinstance(alpha, pd.DataFrame):
+        return pd.Series(epsilon, index = alpha.index)
     return epsilon
-    
+
+
+def varying_epsilon(exreturns, marketReturns, rf):
+    '''calculates a value of epsilon depending on Jensen's Alpha'''
+    np_alpha = jensen_alpha(exreturns, marketReturns, rf)[0]
+    return float(epsilon_from_alpha(np_alpha))
+
+
+def rolling_varying_epsilon(exreturns, marketReturns, rf, length):
+    '''varying_epsilon of every rolling window exreturns[n:length+n], from rolling_jensen_alpha'''
+    return epsilon_from_alpha(rolling_jensen_alpha(exreturns, marketReturns, rf, length)[0])
+
 
 
 # #############################################################################
@@ -771,15 +2013,11 @@ def risk_contribution(weights, varCov):
 def risk_objective(x, args):
     '''objective function to be minimized'''
     Variance = args[0]
-    x_t = np.asmatrix(args[1]).T
-    #problem is sigmapfd
-    x = np.asmatrix(x).T
-    sigmapf = float(np.sqrt(np.dot(x.T , np.dot(Variance, x))))
-    risk_target = np.multiply(sigmapf, x_t)
-    #problem is this
-    diff = risk_contribution(x, Variance) - risk_target
-    opt_pi = [i**2 for i in diff]
-    J = np.multiply(10000 , sum(opt_pi))
+    x_t = _as_weights(args[1])
+    sigmapf = PF_volatility_nd(x, Variance)
+    risk_target = sigmapf * x_t
+    diff = risk_contribution_nd(x, Variance) - risk_target
+    J = 10000 * np.dot(diff, diff)
     return float(J)
 
 def weight_constraint(x):
@@ -817,7 +2055,7 @@ def lpm_port(estMu, corrReturns, exp_ret_chosen = 0.02):
                     L_matrix[i,j] = CO_LowerPartialMoments(returns[indices[i]],returns[indices[j]])
                 elif isinstance(returns, np.ndarray):
                     L_matrix[i,j] = CO_LowerPartialMoments(returns[:,i],returns[:,j])
-        return PF_variance(x, L_matrix)
+        return PF_variance_nd(x, L_matrix)
     w0 = np.random.rand(nAssets)
     cons = ({'type' : 'eq', 'fun' : weight_constraint},
                     {'type' : 'eq', 'fun' : expected_return_constraint_LPM})
@@ -852,7 +2090,7 @@ def lpm_port_noshort(estMu, corrReturns, exp_ret_chosen = 0.02):
                     L_matrix[i,j] = CO_LowerPartialMoments(returns[indices[i]],returns[indices[j]])
                 elif isinstance(returns, np.ndarray):
                     L_matrix[i,j] = CO_LowerPartialMoments(returns[:,i],returns[:,j])
-        return PF_variance(x, L_matrix)
+        return PF_variance_nd(x, L_matrix)
     w0 = np.random.rand(nAssets)
     cons = ({'type' : 'eq', 'fun' : weight_constraint},
                     {'type' : 'eq', 'fun' : expected_return_constraint_LPM},
@@ -885,6 +2123,11 @@ def getIVP(cov, **kargs):
     ivp /= ivp.sum()
     return ivp
 
+def getIVP_batch(cov, **kargs):
+    # Inverse-variance portfolio of every covariance matrix of a (W, N, N) stack, shape (W, N)
+    ivp = 1. / np.diagonal(cov, axis1 = -2, axis2 = -1)
+    return ivp / ivp.sum(axis = -1, keepdims = True)
+
 #to do 2
 def getClusterVar(cov,cItems):
     # Compute variance per cluster
@@ -1156,15 +2399,7 @@ def InformationRatio(returns, marketReturns):
     return intercept / slope
 
 def turnover(weights_t_0, return_t, weights_t_1):
-    if len(weights_t_0.shape)==1:
-        weights_t_0 = np.asmatrix(weights_t_0).T
-    if len(weights_t_1.shape)==1:
-        weights_t_1 = np.asmatrix(weights_t_1).T
-    if len(return_t.shape)==1:
-        return_t = np.asmatrix(return_t).T
-    weights_end_t_0 = np.multiply(weights_t_0 , (1 + return_t))
-    diff_weights = abs(weights_t_1 - weights_end_t_0)
-    return sum(diff_weights)[0,0]
+    return turnover_nd(weights_t_0, return_t, weights_t_1)
 
 
 
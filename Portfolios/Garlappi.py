@@ -4,7 +4,6 @@ name = gu()
 
 import os
 import pandas as pd
-import numpy as np
 import matplotlib.pyplot as plt
 
 import sys
@@ -23,59 +22,31 @@ years = [4, 5, 6, 8, 10]
 epsilon = [0.50, 1.00, 1.50, 2.00, 3.00]
 gamma_list = [0.5, 1, 1.5, 2, 3]
 
-for y in years:    
-    returns, rf_rate, market, estLength, nAssets = get_Data(freq, y)
-    
+store = WeightStore('/Users/%s/OneDrive/Master Thesis/Data/Portfolios/weight_store' %name)
+
+#prefix sums of the returns, shared by all estimation lengths
+moments = get_moment_index('main')
+returns = get_dataset('main', years[0], freq)[0]
+
+#weights of the whole sweep, (years, gamma, epsilon, date, asset)
+GWcube, datesCube, indices = guw_weight_cube(returns, years, gamma_list, epsilon, moments = moments)
+
+for i, y in enumerate(years):    
+    returns, rf_rate, market, estLength, nAssets = get_dataset('main', y, freq)
     
     #Index dates for dataframe
     datesPF = returns.index.values[(estLength-1):(len(returns.index)-1)] 
     
-    #Index dates for dataframe
-    datesImpl = returns.index.values[(estLength):(len(returns.index))]
-    
-     #Column names for dataframe
-    indices = returns.columns.values 
-    
-    #initialize monthly return matrix with each asset after implementation
-    retGW = np.zeros((len(returns.index)-estLength,nAssets)) 
-    
-    #initialize monthly return vector of Portfolio after implementation
-    retPFGW = np.zeros((len(returns.index)-estLength,1)) 
-    
-    #initialize matrix for Garlappi Wang portfolio weights
-    GWPFdyn = np.zeros((len(returns.index)-estLength,nAssets)) 
-    
-    #initialize historical return vector for month after implementation of strategy
-    histRet = np.zeros((1,nAssets))
-
-    
 #    GWweights_noshort(returns, meanRet, varCovar, epsilon, gamma)
-    for gamma in gamma_list:
-        for eps in epsilon:
-            for n in range(0,(len(returns.index)-estLength)):
-                '''loop in order to calculate the efficient portfolios in each period'''
-                df_estimation = returns[n:estLength+n]
-                meanRet = np.asmatrix(np.mean(df_estimation)).T
-                varCovar = np.cov(df_estimation.T, ddof=1)
-                
-                #identify the correct risk free rates, convert them in monthly figures, and put them in df format
-                rf_ann = np.array([float(x) for x in rf_rate[n:estLength+n].values])
-                if freq == "M":
-                    rf = np.array([(1. + i) ** (1. / 12) - 1 for i in rf_ann])
-                elif freq == "W":
-                    rf = np.array([(1. + i) ** (1. / 52) - 1 for i in rf_ann])
-                elif freq == "D":
-                    rf = np.array([(1. + i) ** (1. / 365) - 1 for i in rf_ann])
-                #convert back to dataframe
-            #    rf = pd.DataFrame(rf, index = rf_rate.iloc[n-1:estLength+n-1].index, columns = ["rf"])
-            
-                rets = df_estimation.values
-                
-                gw = GWweights1(rets, meanRet, varCovar, eps, gamma)
-    #            gw = GWweights1(exrets, meanRet, varCovar, eps, gamma)
-                GWPFdyn[n,:] = np.asmatrix(gw).T
+    for j, gamma in enumerate(gamma_list):
+        for k, eps in enumerate(epsilon):
+            #the cube starts with the shortest estimation length, drop the rows before the first window
+            GWPFdyn = GWcube[i, j, k, len(datesCube) - len(datesPF):]
             
             #format data as dataframe with dates and column names    
             GWPortfolios = pd.DataFrame(GWPFdyn, index = datesPF, columns = indices) 
+            store.append(GWPortfolios, 'GUW', y, gamma = gamma, epsilon = eps,
+                         label = 'GUWPortfoliosM{}-gamma{:3.1f}_epsilon{:3.1f}.csv'.format(y, gamma, eps))
+            #csv kept until every backtest reads from the store
             os.chdir('/Users/%s/OneDrive/Master Thesis/Data/Portfolios/' %name)
             GWPortfolios.to_csv('GUWPortfoliosM{}-gamma{:3.1f}_epsilon{:3.1f}.csv'.format(y, gamma, eps))
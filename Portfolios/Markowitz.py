@@ -17,7 +17,9 @@ from Functions import *
 freq = 'M'
 years = 10
 
-returns, rf_rate, market, estLength, nAssets = get_Data(freq, years) # years of estimation
+returns, rf_rate, market, estLength, nAssets = get_dataset('main', years, freq) # years of estimation
+rf_curve = RiskFreeCurve(rf_rate) # periodic risk free rates, converted once
+rf_curve1 = RiskFreeCurve(rf_rate, column = 1) # same for the second risk free column
 
 
 
@@ -52,13 +54,7 @@ for n in range(0,(len(returns.index)-estLength)):
     '''calculate the min var portfolio and assign the output vector to the matrix of portfolio weights'''
 
     '''calculate the max slope portfolio and assign the output vector to the matrix of portfolio weights'''
-    rf_ann = rf_rate.iloc[estLength + n - 1]
-    if freq == "M":
-        rf = (1. + rf_ann) ** (1. / 12) - 1
-    elif freq == "W":
-        rf = (1. + rf_ann) ** (1. / 52) - 1
-    elif freq == "D":
-        rf = (1. + rf_ann) ** (1. / 365) - 1
+    rf = rf_curve.rate(estLength + n - 1, freq)
 
     maxSloPF = maxSRPF_noshort(meanRet, estSigma, rf)
     maxSlopePFdyn[n,:] = maxSloPF.T       
@@ -84,6 +80,9 @@ checkoneMS = MSPortfolios.sum(axis=1) #check if weights sum to 1
 
 os.chdir("/Users/%s/OneDrive/Master Thesis/Data/Portfolios/no_short_sale/" %name)
 #MVPortfolios.to_csv('MVPortfolios{}{}.csv'.format(freq, years))
+store = WeightStore('/Users/%s/OneDrive/Master Thesis/Data/Portfolios/weight_store' %name)
+store.append(MSPortfolios, 'MS', years, short = False, label = 'MSPortfolios{}{}.csv'.format(freq, years))
+#csv kept until every backtest reads from the store
 MSPortfolios.to_csv('MSPortfolios{}{}.csv'.format(freq, years))
 
 
@@ -103,32 +102,27 @@ gamma = 4.
 
 count = 0
 
-for n in range(0,(len(returns.index)-estLength)):
-    '''loop in order to calculate the efficient portfolios in each period'''
-    df_estimation = returns[n:estLength + n]
-    '''extract the estimation data from the dataset'''
-    meanRet = np.array(df_estimation.mean())
-    '''calculate mean returns of the estimation dataset'''
-    estSigma = np.cov(df_estimation.T)
-    rf_ann = rf_rate.iloc[(estLength + n - 1, 1)]
-    if freq == "M":
-        rf = (1. + rf_ann) ** (1. / 12) - 1
-    elif freq == "W":
-        rf = (1. + rf_ann) ** (1. / 52) - 1
-    elif freq == "D":
-        rf = (1. + rf_ann) ** (1. / 365) - 1
-    tangPF = maxSRPF1(meanRet, estSigma, rf)
-    tangPFs[n,:] = tangPF 
-    tangWeight = tangWeights(meanRet, estSigma, rf, gamma)
-    tangPFs_cara[n,:] = tangWeight
-    histRet = np.array(returns.iloc[(estLength + n)])
-    retAM[n,:] = np.array(np.multiply(tangPF, histRet))
-    retPFM[n,:] = retAM[n,:].sum()
+#all estimation windows at once: means (W, N), covariances (W, N, N), one solve per window
+windows = rolling_windows(returns, estLength)[:-1]
+moments = MomentSummary(batched_mean(windows), batched_cov(windows))
+rf = rf_curve1.window(estLength - 1, len(returns.index) - 1, freq)
+
+tangPFs = maxSRPF_batch(moments, None, rf)
+tangPFs_cara = tangWeights_batch(moments.excess(rf), None, gamma)
+
+#tangency portfolios on the Bayes-Stein (Jorion) means, sharing the factorisation of the windows
+moments_BS = bayes_stein_mean(moments, None, estLength)[0]
+tangPFs_BS = maxSRPF_batch(moments_BS, None, rf)
+
+retAM = tangPFs * returns.values[estLength:]
+retPFM = retAM.sum(axis = 1, keepdims = True)
 
 
 df_tanPFs = pd.DataFrame(tangPFs, index = datesPF, columns = indices)
+df_tanPFs_BS = pd.DataFrame(tangPFs_BS, index = datesPF, columns = indices)
 
 MSPortfolios.to_csv('TanPortfolios{}{}Y.csv'.format(freq, years))
+store.append(df_tanPFs_BS, 'TanBS', years, label = 'TanBSPortfolios{}{}.csv'.format(freq, years))
 
 
 
@@ -138,9 +132,8 @@ list_df_estimation = []
 list_varCovar = []
 listMeanRet = []
 
-Skewness = []
-Kurtosis = []
-TailRatio = []
+#skewness, kurtosis and tail ratio of every estimation window in one pass
+Skewness, Kurtosis, TailRatio = rolling_higher_moments(returns, estLength)
 
 dates_analysis = []
 for n in range(0,(len(returns.index)-estLength)):
@@ -151,19 +144,10 @@ for n in range(0,(len(returns.index)-estLength)):
     meanRet = np.array(df_estimation.mean())
     '''calculate mean returns of the estimation dataset'''
     estSigma = np.cov(df_estimation.T)
-    rf_ann = rf_rate.iloc[(estLength + n - 1, 1)]
-    if freq == "M":
-        rf = (1. + rf_ann) ** (1. / 12) - 1
-    elif freq == "W":
-        rf = (1. + rf_ann) ** (1. / 52) - 1
-    elif freq == "D":
-        rf = (1. + rf_ann) ** (1. / 365) - 1
+    rf = rf_curve1.rate(estLength + n - 1, freq)
     tangPF = maxSRPF1(meanRet, estSigma, rf)
     index = datetime.date((df_estimation.index[estLength-1]))
     dates_analysis.append(index)
-    Skewness.append(df_estimation.skew())
-    Kurtosis.append(df_estimation.kurtosis())
-    TailRatio.append([tail_ratio(df_estimation[indices[i]])for i in range(nAssets)])
     
     if (np.max(tangPF) or abs(np.min(tangPF))) > 10:
         globals() ["df_estimation_"+str(index)] = df_estimation
@@ -181,9 +165,10 @@ for n in range(0,(len(returns.index)-estLength)):
     retPFM[n,:] = retAM[n,:].sum()
 
 
-Skewness = pd.DataFrame(Skewness, index = dates_analysis, columns = indices) 
-Kurtosis = pd.DataFrame(Kurtosis, index = dates_analysis, columns = indices)
-TailRatio = pd.DataFrame(TailRatio, index = dates_analysis, columns = indices)
+#drop the last window (no out-of-sample month), as the loop does
+Skewness = Skewness.iloc[:-1].set_axis(dates_analysis, axis = 0)
+Kurtosis = Kurtosis.iloc[:-1].set_axis(dates_analysis, axis = 0)
+TailRatio = TailRatio.iloc[:-1].set_axis(dates_analysis, axis = 0)
 
 
 ######################################################################################################
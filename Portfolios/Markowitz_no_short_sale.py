@@ -18,7 +18,9 @@ from Functions import *
 freq = 'M'
 years = 8
 
-returns, rf_rate, market, estLength, nAssets = get_Data(freq, years) # years of estimation
+returns, rf_rate, market, estLength, nAssets = get_dataset('main', years, freq) # years of estimation
+rf_curve = RiskFreeCurve(rf_rate) # periodic risk free rates, converted once
+rf_curve1 = RiskFreeCurve(rf_rate, column = 1) # same for the second risk free column
 
 
 
@@ -53,13 +55,7 @@ for n in range(0,(len(returns.index)-estLength)):
     
 
     '''calculate the max slope portfolio and assign the output vector to the matrix of portfolio weights'''
-    rf_ann = rf_rate.iloc[estLength + n - 1]
-    if freq == "M":
-        rf = (1. + rf_ann) ** (1. / 12) - 1
-    elif freq == "W":
-        rf = (1. + rf_ann) ** (1. / 52) - 1
-    elif freq == "D":
-        rf = (1. + rf_ann) ** (1. / 365) - 1
+    rf = rf_curve.rate(estLength + n - 1, freq)
     
     maxSloPF = np.array([float(x) for x in maxSRPF_noshort(meanRet, estSigma, rf)])
     maxSlopePFdyn[n,:] = maxSloPF    
@@ -81,6 +77,9 @@ df_retPFM = pd.DataFrame(retPFM, index = datesImpl, columns = ["PFret"])
 os.chdir("/Users/%s/OneDrive/Master Thesis/Data/Portfolios/no_short_sale" %name)
 MVPortfolios.to_csv('MVPortfolios{}{}.csv'.format(freq, years))
 MSPortfolios.to_csv('MSPortfolios{}{}.csv'.format(freq, years))
+#same block as Markowitz.py, otherwise the store would hide this csv from the backtests
+store = WeightStore('/Users/%s/OneDrive/Master Thesis/Data/Portfolios/weight_store' %name)
+store.append(MSPortfolios, 'MS', years, short = False, label = 'MSPortfolios{}{}.csv'.format(freq, years))
 
 
 
@@ -106,13 +105,7 @@ for n in range(0,(len(returns.index)-estLength)):
     meanRet = np.array(df_estimation.mean())
     '''calculate mean returns of the estimation dataset'''
     estSigma = np.cov(df_estimation.T)
-    rf_ann = rf_rate.iloc[(estLength + n - 1, 1)]
-    if freq == "M":
-        rf = (1. + rf_ann) ** (1. / 12) - 1
-    elif freq == "W":
-        rf = (1. + rf_ann) ** (1. / 52) - 1
-    elif freq == "D":
-        rf = (1. + rf_ann) ** (1. / 365) - 1
+    rf = rf_curve1.rate(estLength + n - 1, freq)
     tangPF = maxSRPF1(meanRet, estSigma, rf)
     tangPFs[n,:] = tangPF 
     tangWeight = tangWeights(meanRet, estSigma, rf, gamma)
@@ -134,9 +127,8 @@ list_df_estimation = []
 list_varCovar = []
 listMeanRet = []
 
-Skewness = []
-Kurtosis = []
-TailRatio = []
+#skewness, kurtosis and tail ratio of every estimation window in one pass
+Skewness, Kurtosis, TailRatio = rolling_higher_moments(returns, estLength)
 
 dates_analysis = []
 for n in range(0,(len(returns.index)-estLength)):
@@ -147,19 +139,10 @@ for n in range(0,(len(returns.index)-estLength)):
     meanRet = np.array(df_estimation.mean())
     '''calculate mean returns of the estimation dataset'''
     estSigma = np.cov(df_estimation.T)
-    rf_ann = rf_rate.iloc[(estLength + n - 1, 1)]
-    if freq == "M":
-        rf = (1. + rf_ann) ** (1. / 12) - 1
-    elif freq == "W":
-        rf = (1. + rf_ann) ** (1. / 52) - 1
-    elif freq == "D":
-        rf = (1. + rf_ann) ** (1. / 365) - 1
+    rf = rf_curve1.rate(estLength + n - 1, freq)
     tangPF = maxSRPF1(meanRet, estSigma, rf)
     index = datetime.date((df_estimation.index[estLength-1]))
     dates_analysis.append(index)
-    Skewness.append(df_estimation.skew())
-    Kurtosis.append(df_estimation.kurtosis())
-    TailRatio.append([tail_ratio(df_estimation[indices[i]])for i in range(nAssets)])
     
     if (np.max(tangPF) or abs(np.min(tangPF))) > 10:
         globals() ["df_estimation_"+str(index)] = df_estimation
@@ -177,9 +160,10 @@ for n in range(0,(len(returns.index)-estLength)):
     retPFM[n,:] = retAM[n,:].sum()
 
 
-Skewness = pd.DataFrame(Skewness, index = dates_analysis, columns = indices) 
-Kurtosis = pd.DataFrame(Kurtosis, index = dates_analysis, columns = indices)
-TailRatio = pd.DataFrame(TailRatio, index = dates_analysis, columns = indices)
+#drop the last window (no out-of-sample month), as the loop does
+Skewness = Skewness.iloc[:-1].set_axis(dates_analysis, axis = 0)
+Kurtosis = Kurtosis.iloc[:-1].set_axis(dates_analysis, axis = 0)
+TailRatio = TailRatio.iloc[:-1].set_axis(dates_analysis, axis = 0)
 
 
 ######################################################################################################
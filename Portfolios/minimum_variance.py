@@ -15,7 +15,9 @@ from Functions import *
 freq = 'M'
 years = 8
 
-returns, rf_rate, market, estLength, nAssets = get_Data(freq, years) # years of estimation
+returns, rf_rate, market, estLength, nAssets = get_dataset('main', years, freq) # years of estimation
+rf_curve = RiskFreeCurve(rf_rate) # periodic risk free rates, converted once
+moments = MomentIndex(returns) # window means and covariances from prefix sums
 
 
 
@@ -39,21 +41,15 @@ for n in range(0,(len(returns.index)-estLength)):
     '''loop in order to calculate the efficient portfolios in each period'''
     df_estimation = returns[n:estLength+n]
     '''extract the estimation data from the dataset'''
-    meanRet = np.asmatrix(np.mean(df_estimation)).T
+    meanRet = np.asmatrix(moments.mean(n, estLength)).T
     '''calculate mean returns of the estimation dataset'''
-    estSigma = np.cov(df_estimation.T)
+    estSigma = moments.cov(n, estLength)
     
     ''' NOTE: the portfolios sum to one '''
     minvar = np.array([float(x) for x in minVarPF_noshort(estSigma)])
     minvar_PFdyn[n,:] = minvar
 
-    rf_ann = rf_rate.iloc[estLength + n - 1]
-    if freq == "M":
-        rf = (1. + rf_ann) ** (1. / 12) - 1
-    elif freq == "W":
-        rf = (1. + rf_ann) ** (1. / 52) - 1
-    elif freq == "D":
-        rf = (1. + rf_ann) ** (1. / 365) - 1
+    rf = rf_curve.rate(estLength + n - 1, freq)
     
     histRet = np.array(returns.iloc[(estLength + n)])
     retAM[n,:] = np.array(np.multiply(minvar, (np.exp(np.asmatrix(histRet))-1)))
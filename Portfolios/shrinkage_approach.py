@@ -10,12 +10,13 @@ import matplotlib.pyplot as plt
 import sys
 sys.path.append('/Users/%s/OneDrive/Master Thesis/Data/Analysis_Skripts/Library/' %name)
 from Functions import *
-from sklearn.covariance import ledoit_wolf as LW, oas, shrunk_covariance
+from sklearn.covariance import oas, shrunk_covariance
 
 freq = 'M'
 years = 10
 
-returns, rf_rate, market, estLength, nAssets = get_Data(freq, years) # years of estimation
+returns, rf_rate, market, estLength, nAssets = get_dataset('main', years, freq) # years of estimation
+rf_curve = RiskFreeCurve(rf_rate) # periodic risk free rates, converted once
 
 
 #Index dates for dataframe
@@ -41,7 +42,9 @@ MPT_OAS = np.zeros((len(returns.index)-estLength,nAssets))
 #initialize historical return vector for month after implementation of strategy
 histRet = np.zeros((1,nAssets))
 
-
+#shrunk covariance matrices of all estimation windows, in one pass
+shrunkLW = rolling_shrunk_cov(returns, estLength, 'lw', assume_centered = True)[0]
+#shrunkOAS = rolling_shrunk_cov(returns, estLength, 'oas', assume_centered = True)[0]
 
 
 for n in range(0,(len(returns.index)-estLength)):
@@ -51,16 +54,10 @@ for n in range(0,(len(returns.index)-estLength)):
     histRet = returns.iloc[(estLength + n)] 
     
     #identify the correct risk free rates, convert them in monthly figures, and put them in df format
-    rf_ann = rf_rate.iloc[estLength + n - 1]
-    if freq == "M":
-        rf = (1. + rf_ann) ** (1. / 12) - 1
-    elif freq == "W":
-        rf = (1. + rf_ann) ** (1. / 52) - 1
-    elif freq == "D":
-        rf = (1. + rf_ann) ** (1. / 365) - 1
+    rf = rf_curve.rate(estLength + n - 1, freq)
 
     '''Calculation of optimal portfolio based on Ledoit Wolf Shrinkage'''
-    shrunkVarCovarLW = LW(df_estimation, assume_centered = True)[0]
+    shrunkVarCovarLW = shrunkLW[n]
     maxSlopePF = np.array([float(x) for x in maxSRPF_noshort(meanRet, shrunkVarCovarLW, rf)])
 #    maxSlopePF =  maxSlopePF1(meanRet, shrunkVarCovarLW)
     MPT_LW[n,:] = maxSlopePF
@@ -69,7 +66,7 @@ for n in range(0,(len(returns.index)-estLength)):
     retPF_LW[n,:] = retAssetsLW[n,:].sum()
     
 #    '''Calculation of optimal portfolio based on OAS Shrinkage'''
-#    shrunkVarCovarOAS = oas(df_estimation, assume_centered = True)[0]
+#    shrunkVarCovarOAS = shrunkOAS[n]
 #    maxSlopePF =    1 / var_B(meanRet, shrunkVarCovarOAS) * \
 #                    np.dot(mat_inv(shrunkVarCovarOAS), meanRet)
 #    MPT_OAS[n,:] = maxSlopePF
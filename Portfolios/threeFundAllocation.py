@@ -18,7 +18,9 @@ from Functions import *
 freq = 'M'
 years = 4
 
-returns, rf_rate, market, estLength, nAssets = get_Data(freq, years) # years of estimation
+returns, rf_rate, market, estLength, nAssets = get_dataset('main', years, freq) # years of estimation
+rf_curve = RiskFreeCurve(rf_rate) # periodic risk free rates, converted once
+moments = MomentIndex(returns) # window means and covariances from prefix sums
 
 
 datesPF = returns.index.values[(estLength-1):(len(returns.index)-1)] #Index dates for dataframe
@@ -33,37 +35,23 @@ retPFM = np.zeros((len(returns.index)-estLength,1)) #monthly return of Portfolio
 
 histRet = np.zeros((1,nAssets))
 
-threeFund_PFdyn = np.zeros((len(returns.index)-estLength,nAssets)) #initializes matrix for min var portfolio
-
-gamma = 1
-
-for n in range(0,(len(returns.index)-estLength)):
-    '''loop in order to calculate the efficient portfolios in each period'''
-    df_estimation = returns[n:estLength+n]
-    '''extract the estimation data from the dataset'''
-    meanRet = np.asmatrix(np.mean(df_estimation)).T
-    '''calculate mean returns of the estimation dataset'''
-    estSigma = np.cov(df_estimation.T)
-    
-    rf_ann = np.array([float(x) for x in rf_rate[n:estLength+n].values])
-    if freq == "M":
-        rf = np.array([(1. + i) ** (1. / 12) - 1 for i in rf_ann])
-    elif freq == "W":
-        rf = np.array([(1. + i) ** (1. / 52) - 1 for i in rf_ann])
-    elif freq == "D":
-        rf = np.array([(1. + i) ** (1. / 365) - 1 for i in rf_ann])
-    #convert back to dataframe
-#    rf = pd.DataFrame(rf, index = rf_rate.iloc[n-1:estLength+n-1].index, columns = ["rf"])
-
-    exrets = df_estimation.values - np.asmatrix(rf).T
-    meanRet_exc = np.asmatrix(np.mean(exrets, axis = 0)).T
-    threeFund = threeFundSeparationEMP(meanRet_exc, estSigma, estLength, gamma)
-    threeFund = np.array([float(x) for x in threeFund])
-
-    threeFund_PFdyn[n,:] = threeFund
-
-threeFundPortfolios = pd.DataFrame(threeFund_PFdyn, index = datesPF, columns = indices) #format data as dataframe with dates and column names
-checkonethreeFund = threeFundPortfolios.sum(axis=1) #check if weights sum to 1
-
-os.chdir("/Users/%s/OneDrive/Master Thesis/Data/Portfolios/" %name)
-threeFundPortfolios.to_csv('threeFundPortfolios{}{}.csv'.format(freq, years))
+gamma_list = [1]
+
+#moments of every estimation window at once, excess of the mean risk free rate of the window
+starts = np.arange(len(returns.index) - estLength)
+rf_all = rf_curve.window(0, len(returns.index), freq)
+meanRet_exc = moments.means(starts, estLength) - batched_mean(rolling_windows(rf_all[:, None], estLength))[starts]
+estSigma = moments.covs(starts, estLength)
+
+#three fund weights, (gamma, date, asset)
+threeFund_PFdyn = threeFund_batch(meanRet_exc, estSigma, estLength, gamma_list)
+
+store = WeightStore('/Users/%s/OneDrive/Master Thesis/Data/Portfolios/weight_store' %name)
+for j, gamma in enumerate(gamma_list):
+    threeFundPortfolios = pd.DataFrame(threeFund_PFdyn[j], index = datesPF, columns = indices) #format data as dataframe with dates and column names
+    checkonethreeFund = threeFundPortfolios.sum(axis=1) #check if weights sum to 1
+    store.append(threeFundPortfolios, 'threeFund', years, gamma = gamma,
+                 label = 'threeFundPort{}{}-gamma{:3.1f}.csv'.format(freq, years, gamma))
+    #csv kept until every backtest reads from the store
+    os.chdir("/Users/%s/OneDrive/Master Thesis/Data/Portfolios/" %name)
+    threeFundPortfolios.to_csv('threeFundPort{}{}-gamma{:3.1f}.csv'.format(freq, years, gamma))
@@ -18,7 +18,12 @@ from Functions import *
 freq = 'M'
 years = 7
 
-returns, rf_rate, market, estLength, nAssets = get_Data(freq, years) # years of estimation
+returns, rf_rate, market, estLength, nAssets = get_dataset('main', years, freq) # years of estimation
+rf_curve = RiskFreeCurve(rf_rate) # periodic risk free rates, converted once
+moments = MomentIndex(returns) # window means and covariances from prefix sums
+rolling = RollingPrecision(returns, estLength) # inverse covariance, updated window by window
+#epsilon implied by the Jensen alphas of every window, rolling normal equations
+epsilons = rolling_varying_epsilon(returns.values, market.values, rf_curve.window(0, len(returns.index), freq), estLength)
 
 
 
@@ -41,30 +46,16 @@ gamma = 1
 for n in range(0,(len(returns.index)-estLength)):
     df_estimation = returns[n:estLength+n]
     '''extract the estimation data from the dataset'''
-    meanRet = np.asmatrix(np.mean(df_estimation)).T
+    meanRet = np.asmatrix(moments.mean(n, estLength)).T
     '''calculate mean returns of the estimation dataset'''
-    estSigma = np.cov(df_estimation.T)
+    estSigma = moments.cov(n, estLength)
     
-    market_estimation = market[n:estLength+n]
-    
-    
-    #identify the correct risk free rates, convert them in monthly figures, and put them in df format
-    rf_ann = np.array([float(x) for x in rf_rate[n:estLength+n].values])
-    if freq == "M":
-        rf = np.array([(1. + i) ** (1. / 12) - 1 for i in rf_ann])
-    elif freq == "W":
-        rf = np.array([(1. + i) ** (1. / 52) - 1 for i in rf_ann])
-    elif freq == "D":
-        rf = np.array([(1. + i) ** (1. / 365) - 1 for i in rf_ann])
-    #convert back to dataframe
-#    rf = pd.DataFrame(rf, index = rf_rate.iloc[n-1:estLength+n-1].index, columns = ["rf"])
-
     rets = df_estimation.values
     mean_rets = np.asmatrix(np.mean(rets, axis = 0)).T
     
     ''' NOTE: the portfolios sum to one '''
-    varyingEpsilon = varying_epsilon(rets, market_estimation.values, rf)
-    ourGarlappi = GWweights1(rets, mean_rets, estSigma, varyingEpsilon, gamma)
+    varyingEpsilon = epsilons[n]
+    ourGarlappi = GWweights1(rets, mean_rets, estSigma, varyingEpsilon, gamma, invSigma = rolling.seek(n))
     
     ourGarlappi_PFdyn[n,:] = np.array([float(x) for x in ourGarlappi])
 
@@ -18,8 +18,12 @@ gamma_list = [0.5, 1.0, 1.5, 2.0, 3.0]
 year = 10
 
 
+returns, rf_rate, market, estLength, nAssets = get_dataset('main', year, freq) # years of estimation
+rf_curve = RiskFreeCurve(rf_rate) # periodic risk free rates, converted once
+#epsilon implied by the Jensen alphas of every window, rolling normal equations
+epsilons = rolling_varying_epsilon(returns.values, market.values, rf_curve.window(0, len(returns.index), freq), estLength)
+
 for gamma in gamma_list:
-    returns, rf_rate, market, estLength, nAssets = get_Data(freq, year) # years of estimation
 
     datesPF = returns.index.values[(estLength-1):(len(returns.index)-1)] #Index dates for dataframe
     datesImpl = returns.index.values[(estLength):(len(returns.index))] #Index dates for dataframe
@@ -38,6 +42,9 @@ for gamma in gamma_list:
     
     limit = (len(returns.index)-estLength)
     
+    #long-only solver warm-started from the previous window
+    path = GWNoShortPath()
+    
     for n in range(0,limit):
         df_estimation = returns[n:estLength+n]
         '''extract the estimation data from the dataset'''
@@ -45,25 +52,11 @@ for gamma in gamma_list:
         '''calculate mean returns of the estimation dataset'''
         estSigma = np.cov(df_estimation.T)
         
-        market_estimation = market[n:estLength+n]
-        
-        
-        #identify the correct risk free rates, convert them in monthly figures, and put them in df format
-        rf_ann = np.array([float(x) for x in rf_rate[n:estLength+n].values])
-        if freq == "M":
-            rf = np.array([(1. + i) ** (1. / 12) - 1 for i in rf_ann])
-        elif freq == "W":
-            rf = np.array([(1. + i) ** (1. / 52) - 1 for i in rf_ann])
-        elif freq == "D":
-            rf = np.array([(1. + i) ** (1. / 365) - 1 for i in rf_ann])
-        #convert back to dataframe
-    #    rf = pd.DataFrame(rf, index = rf_rate.iloc[n-1:estLength+n-1].index, columns = ["rf"])
-    
         rets = df_estimation.values
         
         ''' NOTE: the portfolios sum to one '''
-        varyingEpsilon = varying_epsilon(rets, market_estimation.values, rf)
-        ourGarlappi = GWweights_noshort(rets, meanRet, estSigma, varyingEpsilon, gamma)
+        varyingEpsilon = epsilons[n]
+        ourGarlappi = path.solve(rets, meanRet, estSigma, varyingEpsilon, gamma, label = datesPF[n])
     
         if ourGarlappi.sum() == 10 * len(meanRet):
             ourGarlappi_PFdyn[n,:] = ourGarlappi_PFdyn[n-1,:]
@@ -71,6 +64,10 @@ for gamma in gamma_list:
             ourGarlappi_PFdyn[n,:] = np.array([float(x) for x in ourGarlappi])
 
 
+    status = path.report()
+    if not status.success.all():
+        print('gamma {}: {} window(s) did not converge'.format(gamma, (~status.success).sum()))
+
     ourGarlappiPortfolios = pd.DataFrame(ourGarlappi_PFdyn, index = datesPF, columns = indices)
     #checkoneourGarlappiPortfolios = ourGarlappiPortfolios.sum(axis=1) #check if weights sum to 1
     os.chdir("/Users/%s/OneDrive/Master Thesis/Data/Portfolios/no_short_sale/" %name)
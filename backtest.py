@@ -10,48 +10,224 @@ from datetime import timedelta
 from dateutil.relativedelta import relativedelta
 from openpyxl import load_workbook
 from openpyxl import Workbook
+import threading
+import queue
 from Functions import *
 
 
-def backtester_NEW2(start, end, file, gamma_presence = False, save = False):
+#folder the backtest results are written to
+results_folder = '/Users/{}/OneDrive/Master Thesis/Data/Portfolios/backtesting/no_short_sale'.format(name)
+
+
+class ResultSink(object):
+    '''Where the backtesters persist their results.
+       write() receives the folder of the run (relative to the sink), the file name of the run, the per-run
+       tables in sheet order and the asset-return panel, which is the same for every run of a dataset and
+       backtest period and is identified by panel_name (period and content hash of the panel).'''
+
+    def write(self, folder, filename, tables, panel_name, panel):
+        raise NotImplementedError
+
+
+class ColumnarSink(ResultSink):
+    '''Default sink: the tables of a run go to one binary .npz file (see save_frames), the asset-return
+       panel is written only once per panel_name next to the run folders. Use export_excel to get the
+       old 7-sheet workbook of a run.'''
+
+    def __init__(self, root = results_folder):
+        self.root = root
+        self.panels = set()
+
+    def write(self, folder, filename, tables, panel_name, panel):
+        path = os.path.join(self.root, folder)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        panel_file = os.path.join(self.root, os.path.dirname(folder), panel_name + '.npz')
+        save_frames(os.path.join(path, filename + '.npz'), tables,
+                    meta = {'panel': os.path.relpath(panel_file, path)})
+        if panel_name not in self.panels:
+            if not os.path.exists(panel_file):
+                save_frames(panel_file, {'asset_returns': panel})
+            self.panels.add(panel_name)
+
+
+class ExcelSink(ResultSink):
+    '''One .xlsx workbook per run with all the tables and the asset-return panel as sheets'''
+
+    def __init__(self, root = results_folder):
+        self.root = root
+
+    def write(self, folder, filename, tables, panel_name, panel):
+        path = os.path.join(self.root, folder)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        write_excel(os.path.join(path, filename + '.xlsx'), tables, panel)
+
+
+class BackgroundWriter(ResultSink):
+    '''Wraps another sink and does its writing on a background thread, so that a sweep keeps computing
+       while the results of the previous runs are written. write() only queues the run; the queue is bounded
+       (maxsize runs) so a slow disk throttles the sweep instead of filling the memory. An error raised by
+       the wrapped sink is re-raised in the caller at the next write(), flush() or close(); call close()
+       (or use a with block, which also writes the queued runs when the sweep fails) at the end of the sweep.
+
+       EXAMPLE: with BackgroundWriter(ColumnarSink()) as writer:
+                    for file in portfolios:
+                        backtester_NEW2(start, end, file, save = True, sink = writer)'''
+
+    def __init__(self, sink = None, maxsize = 32):
+        self.sink = sink if sink is not None else ColumnarSink()
+        self.queue = queue.Queue(maxsize)
+        self.errors = []
+        self.thread = threading.Thread(target = self._run, name = 'BackgroundWriter')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self.sink.write(*item)
+            except Exception as error:
+                self.errors.append(error)
+            finally:
+                self.queue.task_done()
+
+    def _raise(self):
+        if self.errors:
+            error = self.errors.pop(0)
+            raise error
+
+    def write(self, folder, filename, tables, panel_name, panel):
+        self._raise()
+        if not self.thread.is_alive():
+            raise RuntimeError('BackgroundWriter is closed')
+        self.queue.put((folder, filename, tables, panel_name, panel))
+
+    def flush(self):
+        '''wait until every queued run is written'''
+        self.queue.join()
+        self._raise()
+
+    def close(self):
+        '''write what is left in the queue and stop the thread'''
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self._raise()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            #write what was queued, the error of the sweep takes precedence over those of the writer
+            try:
+                self.close()
+            except Exception:
+                pass
+
+
+def write_excel(xlsx_path, tables, panel):
+    '''write the tables of a run and the asset returns as sheets of one workbook'''
+    writer = pd.ExcelWriter(xlsx_path)
+    for sheet, table in tables.items():
+        table.to_excel(writer, sheet_name = sheet)
+    panel.to_excel(writer, sheet_name = 'asset_returns')
+    writer.close()
+
+
+def export_excel(npz_path, xlsx_path = None):
+    '''post-processing: convert a run written by ColumnarSink to the 7-sheet Excel workbook'''
+    tables, meta = load_frames(npz_path)
+    panel_path = os.path.join(os.path.dirname(npz_path), meta['panel'])
+    panel = load_frames(panel_path)[0]['asset_returns']
+    if xlsx_path is None:
+        xlsx_path = npz_path[:-len('.npz')] + '.xlsx'
+    write_excel(xlsx_path, tables, panel)
+    return xlsx_path
+
+
+def save_backtest(sink, start, end, file, filename_bt, initial_date_backtest, tables, retAssets):
+    '''hand the results of one backtest run to a sink'''
+    location = "start_{}".format(initial_date_backtest.year)
+    folder_simul = "BT_{}_{}_{}".format(file[:-4], start, end)
+    #the content hash tells apart panels of other datasets or of an updated workbook over the same dates
+    panel_name = "asset_returns_{}_{}_{}".format(start, end, frame_digest(retAssets)[:12])
+    sink.write(os.path.join(location, folder_simul), filename_bt, tables, panel_name, retAssets)
+
+
+def backtest_tables(performance_output, roll_sharpe, roll_VaR, turnover_pf, w_risky_vector, retPF):
+    '''per-run result tables, in the sheet order of the old Excel output'''
+    return OrderedDict([('Performance Indicators', performance_output),
+                        ('Rolling Sharpe', roll_sharpe),
+                        ('Rolling VaR', roll_VaR),
+                        ('Turnover', turnover_pf),
+                        ('Amount_in_Risky_Asset', w_risky_vector),
+                        ('PF_returns', retPF)])
+
+
+def backtester_NEW2(start, end, file, gamma_presence = False, save = False, data = None, store = None, sink = None, calendar = None):
 
     os.chdir("/Users/%s/OneDrive/Master Thesis/Data" %name)
 
     """ obtain the year and the gamma (for gamma-dependent portfolios) """             
 
-    if file[:3]=="GUW" or file[:3]=="our" or file[:3]=="Mea":
-        if int(file[14]) == 1:
-            years = 10
-        else:
-            years = int(file[14])
-    
-    elif file[:3]=="thr":
-        if int(file[14]) == 1:
-            years = 10
-        else:
-            years = int(file[14])
+    entry = None
+    if store is not None and file in store:
+        #the store index carries the parameters of the weights
+        entry = store.info(file)
+        years = entry['years']
+        if gamma_presence:
+            gamma = entry['gamma']
     else:
-        if int(file[-5]) == 0:
-            years = 10
+        if file[:3]=="GUW" or file[:3]=="our" or file[:3]=="Mea":
+            if int(file[14]) == 1:
+                years = 10
+            else:
+                years = int(file[14])
+    
+        elif file[:3]=="thr":
+            if int(file[14]) == 1:
+                years = 10
+            else:
+                years = int(file[14])
         else:
-            years = int(file[-5])
+            if int(file[-5]) == 0:
+                years = 10
+            else:
+                years = int(file[-5])
 
-    if gamma_presence:
-        if file[:3]=="GUW":
-            if file[14] == str(1):
-                gamma = float(file[22:25])
+        if gamma_presence:
+            if file[:3]=="GUW":
+                if file[14] == str(1):
+                    gamma = float(file[22:25])
+                else:
+                    gamma = float(file[21:24])
             else:
-                gamma = float(file[21:24])
-        else:
-            gamma = float(file[-7:-4])
+                gamma = float(file[-7:-4])
         
     
     freq = 'M'
-    returns, rf_rate, market, estLength, nAssets = get_Data(freq, years) # years of estimation
+    if data is None:
+        #loaded once per process and shared by all the calls of a sweep
+        data = get_dataset('main', years, freq)
+        if calendar is None:
+            calendar = get_calendar('main', freq)
+    returns, rf_rate, market, estLength, nAssets = data # years of estimation
+    if calendar is None:
+        calendar = TradingCalendar(returns.index, freq)
     
     os.chdir("/Users/%s/OneDrive/Master Thesis/Data/Portfolios" %name)
 #    df_weights = convertCSV_toDataframe(file)
-    df_weights = convertCSV_toDataframeTEST(file)
+    if store is not None and file in store:
+        df_weights = store.read_label(file)
+    else:
+        df_weights = read_weights_csv(file)
     
     datesformat = "%Y-%m-%d"
     initial_date_backtest = datetime.strptime(start, datesformat)
@@ -71,30 +247,24 @@ def backtester_NEW2(start, end, file, gamma_presence = False, save = False):
     
     total_w_old = np.asmatrix(np.zeros(nAssets)).T
     
+    #monthly risk free rates of the backtest period, converted once
+    rf_curve = RiskFreeCurve(rf_rate)
+    rf_vect = rf_curve.between(initial_date_backtest, final_date_backtest + relativedelta(months = 1), freq)
+    rf_rate_end_period = rf_curve.at(final_date_backtest, freq)
+    
+    #weights and returns of every month aligned once: a missing date raises here, not mid-loop
+    periods = len(windows_returns.index)
+    weights_matrix = calendar.align(df_weights, calendar.schedule(initial_date_backtest, periods), 'weights')
+    returns_matrix = calendar.align(returns, calendar.schedule(initial_date_backtest, periods, offset = 1), 'returns')
+    retAssets = windows_returns
     
-    for n in range(len(windows_returns.index)):
+    for n in range(periods):
         
-        retAssets = windows_returns
-        rf_ann_window = np.asarray(rf_rate.loc[initial_date_backtest : final_date_backtest + relativedelta(months = 1)])
-        rf_estimation = np.asarray(rf_rate.loc[initial_date_backtest - relativedelta(months = estLength) : initial_date_backtest, :])
-        rf_rate_end_period = float(rf_rate.loc[final_date_backtest])
-
-        rf_vect = np.array([(1. + i) ** (1. / 12) - 1 for i in rf_ann_window])
-        rf_estimation = np.array([(1. + i) ** (1. / 12) - 1 for i in rf_estimation])
-        rf_rate_end_period = (1+ rf_rate_end_period) ** (1. / 12) - 1
         rf = float(rf_vect[n])
         
-        weights_selected = np.array(df_weights.loc[initial_date_backtest + relativedelta(months = n)])
-
-   
-        histRet = np.array(windows_returns.loc[initial_date_backtest + relativedelta(months = n + 1)])
+        weights_selected = weights_matrix[n]
+        histRet = returns_matrix[n]
         #note the return of the assets are discrete returns
-        
-        #calculate the amount to invest in the risky asset
-        months_back = 12 * years
-        returns_est_past = returns.loc[initial_date_backtest - relativedelta(months = months_back - 1) : initial_date_backtest]
-        meanRet = returns_est_past.values.mean(axis=0)
-        estSigma = np.asmatrix(np.cov(returns_est_past.T, ddof=1))
 
         w_risky_portfolio = weights_selected.sum()
         
@@ -148,7 +318,7 @@ def backtester_NEW2(start, end, file, gamma_presence = False, save = False):
     
     performance = {}
     if file[:3]=="GUW":
-        epsilon = float(file[-7:-4])
+        epsilon = entry['epsilon'] if entry is not None else float(file[-7:-4])
         performance["epsilon"] = epsilon
     performance["average return"] = np.mean(retPF)
     performance["standard deviation"] = np.std(retPF, ddof=1)
@@ -183,33 +353,13 @@ def backtester_NEW2(start, end, file, gamma_presence = False, save = False):
     roll_VaR = rollingVar(retPF, roll_window = estLength)
     
     if save:
-        location = "start_{}".format(initial_date_backtest.year)
-        folder_simul = "BT_{}_{}_{}".format(file[:-4], start, end)
         if gamma_presence:
             filename_bt = "{}_gamma-{}".format(datetime.today().strftime("%Y-%m-%d-%H"), gamma)
         else:
             filename_bt = "{}".format(datetime.today().strftime("%Y-%m-%d-%H"))
-             
-        if not os.path.exists('/Users/{}/OneDrive/Master Thesis/Data/Portfolios/backtesting/no_short_sale/{}/{}'.format(name, location, folder_simul)):
-            os.makedirs('/Users/{}/OneDrive/Master Thesis/Data/Portfolios/backtesting/no_short_sale/{}/{}'.format(name, location, folder_simul))
-    
-        os.chdir('/Users/{}/OneDrive/Master Thesis/Data/Portfolios/backtesting/no_short_sale/{}/{}'.format(name, location, folder_simul))
-
-#        old way of saving in cvs
-#        retAssets.to_csv('ret_assets_{}_{}_{}Y_{}_{}_.csv'.format(file[:-4], freq, str(years), start, end))    
-#        retPF.to_csv('PF_rets_{}_{}_{}Y_{}_{}_.csv'.format(file[:-4], freq, str(years), start, end))    
-#        performance_output.to_csv('PF_performance_{}_{}_{}Y_{}_{}_.csv'.format(file[:-4], freq, str(years), start, end))
-
-#        write to excel file
-        writer = pd.ExcelWriter('/Users/{}/OneDrive/Master Thesis/Data/Portfolios/backtesting/no_short_sale/{}/{}/{}.xlsx'.format(name, location, folder_simul, filename_bt))
-        performance_output.to_excel(writer,  sheet_name = 'Performance Indicators')
-        roll_sharpe.to_excel(writer, sheet_name = "Rolling Sharpe")
-        roll_VaR.to_excel(writer, sheet_name = "Rolling VaR")
-        turnover_pf.to_excel(writer, sheet_name = "Turnover")
-        w_risky_vector.to_excel(writer, sheet_name = "Amount_in_Risky_Asset")
-        retPF.to_excel(writer,  sheet_name = 'PF_returns')
-        retAssets.to_excel(writer,  sheet_name='asset_returns')
-        writer.save()
+        tables = backtest_tables(performance_output, roll_sharpe, roll_VaR, turnover_pf, w_risky_vector, retPF)
+        save_backtest(sink if sink is not None else ColumnarSink(), start, end, file, filename_bt,
+                      initial_date_backtest, tables, retAssets)
 
 #    print()
 #    for key, value in performance.items():
@@ -235,30 +385,46 @@ def backtester_NEW2(start, end, file, gamma_presence = False, save = False):
 '''to use only with tangency and tangency ledoit'''
 
 
-def backtester_withGamma(start, end, file, gamma, save = False):
+def backtester_withGamma(start, end, file, gamma, save = False, data = None, store = None, sink = None, calendar = None):
 
     os.chdir("/Users/%s/OneDrive/Master Thesis/Data" %name)
 
     """ obtain the year and the gamma (for gamma-dependent portfolios) """             
 
-    if file[:3]=="GUW" or file[:3]=="our" or file[:3]=="Mea":
-        if int(file[14]) == 1:
-            years = 10
-        else:
-            years = int(file[14])
+    entry = None
+    if store is not None and file in store:
+        #the store index carries the parameters of the weights
+        entry = store.info(file)
+        years = entry['years']
     else:
-        if int(file[-5]) == 0:
-            years = 10
+        if file[:3]=="GUW" or file[:3]=="our" or file[:3]=="Mea":
+            if int(file[14]) == 1:
+                years = 10
+            else:
+                years = int(file[14])
         else:
-            years = int(file[-5])
+            if int(file[-5]) == 0:
+                years = 10
+            else:
+                years = int(file[-5])
 
 
     freq = 'M'
-    returns, rf_rate, market, estLength, nAssets = get_Data(freq, years) # years of estimation
+    if data is None:
+        #loaded once per process and shared by all the calls of a sweep
+        data = get_dataset('main', years, freq)
+        if calendar is None:
+            calendar = get_calendar('main', freq)
+    returns, rf_rate, market, estLength, nAssets = data # years of estimation
+    if calendar is None:
+        calendar = TradingCalendar(returns.index, freq)
     
     os.chdir("/Users/%s/OneDrive/Master Thesis/Data/Portfolios/" %name)
 #    df_weights = convertCSV_toDataframe(file)
-    df_weights = convertCSV_toDataframeTEST(file)
+    if store is not None and file in store:
+        df_weights = store.read_label(file)
+    else:
+        df_weights = read_weights_csv(file)
     
     datesformat = "%Y-%m-%d"
     initial_date_backtest = datetime.strptime(start, datesformat)
@@ -278,32 +444,28 @@ def backtester_withGamma(start, end, file, gamma, save = False):
     
     total_w_old = np.asmatrix(np.zeros(nAssets)).T
     
+    #monthly risk free rates of the backtest period, converted once
+    rf_curve = RiskFreeCurve(rf_rate)
+    rf_vect = rf_curve.between(initial_date_backtest, final_date_backtest + relativedelta(months = 1), freq)
+    rf_rate_end_period = rf_curve.at(final_date_backtest, freq)
     
-    for n in range(len(windows_returns.index)):
-        
-        retAssets = windows_returns
-        rf_ann_window = np.asarray(rf_rate.loc[initial_date_backtest : final_date_backtest + relativedelta(months = 1)])
-        rf_estimation = np.asarray(rf_rate.loc[initial_date_backtest - relativedelta(months = estLength) : initial_date_backtest, :])
-        rf_rate_end_period = float(rf_rate.loc[final_date_backtest])
-
-        rf_vect = np.array([(1. + i) ** (1. / 12) - 1 for i in rf_ann_window])
-        rf_estimation = np.array([(1. + i) ** (1. / 12) - 1 for i in rf_estimation])
-        rf_rate_end_period = (1+ rf_rate_end_period) ** (1. / 12) - 1
-        
-
-        
-        weights_selected = np.array(df_weights.loc[initial_date_backtest + relativedelta(months = n)])
-
+    #weights and returns of every month aligned once: a missing date raises here, not mid-loop
+    periods = len(windows_returns.index)
+    weights_matrix = calendar.align(df_weights, calendar.schedule(initial_date_backtest, periods), 'weights')
+    returns_matrix = calendar.align(returns, calendar.schedule(initial_date_backtest, periods, offset = 1), 'returns')
+    retAssets = windows_returns
+    
+    #calculate the amount to invest in the risky asset (the estimation window does not move with n)
+    months_back = 12 * years
+    returns_est_past = returns.loc[initial_date_backtest - relativedelta(months = months_back - 1) : initial_date_backtest]
+    meanRet = returns_est_past.values.mean(axis=0)
+    estSigma = np.asmatrix(np.cov(returns_est_past.T, ddof=1))
+    
+    for n in range(periods):
         
-        histRet = np.array(windows_returns.loc[initial_date_backtest + relativedelta(months = n + 1)])
+        weights_selected = weights_matrix[n]
+        histRet = returns_matrix[n]
         #note the return of the assets are discrete returns
-        
-        #calculate the amount to invest in the risky asset
-        months_back = 12 * years
-        returns_est_past = returns.loc[initial_date_backtest - relativedelta(months = months_back - 1) : initial_date_backtest]
-        meanRet = returns_est_past.values.mean(axis=0)
-        estSigma = np.asmatrix(np.cov(returns_est_past.T, ddof=1))
-        
 
         pf_ret_ex_ante = PF_return(weights_selected, meanRet)
         pf_sigma_ex_ante = np.sqrt(PF_variance(weights_selected, estSigma))
@@ -350,7 +512,7 @@ def backtester_withGamma(start, end, file, gamma, save = False):
     
     performance = {}
     if file[:3]=="GUW":
-        epsilon = float(file[-7:-4])
+        epsilon = entry['epsilon'] if entry is not None else float(file[-7:-4])
         performance["epsilon"] = epsilon
     performance["average return"] = np.mean(retPF)
     performance["standard deviation"] = np.std(retPF, ddof=1)        
@@ -383,29 +545,10 @@ def backtester_withGamma(start, end, file, gamma, save = False):
     roll_VaR = rollingVar(retPF, roll_window = estLength)
     
     if save:
-        location = "start_{}".format(initial_date_backtest.year)
-        folder_simul = "BT_{}_{}_{}".format(file[:-4], start, end)
         filename_bt = "{}_gamma-{}".format(datetime.today().strftime("%Y-%m-%d-%H"), gamma)
-        if not os.path.exists('/Users/{}/OneDrive/Master Thesis/Data/Portfolios/backtesting/no_short_sale/{}/{}'.format(name, location, folder_simul)):
-            os.makedirs('/Users/{}/OneDrive/Master Thesis/Data/Portfolios/backtesting/no_short_sale/{}/{}'.format(name, location, folder_simul))
-    
-        os.chdir('/Users/{}/OneDrive/Master Thesis/Data/Portfolios/backtesting/no_short_sale/{}/{}'.format(name, location, folder_simul))
-
-#        old way of saving in cvs
-#        retAssets.to_csv('ret_assets_{}_{}_{}Y_{}_{}_.csv'.format(file[:-4], freq, str(years), start, end))    
-#        retPF.to_csv('PF_rets_{}_{}_{}Y_{}_{}_.csv'.format(file[:-4], freq, str(years), start, end))    
-#        performance_output.to_csv('PF_performance_{}_{}_{}Y_{}_{}_.csv'.format(file[:-4], freq, str(years), start, end))
-
-#        write to excel file
-        writer = pd.ExcelWriter('/Users/{}/OneDrive/Master Thesis/Data/Portfolios/backtesting/no_short_sale/{}/{}/{}.xlsx'.format(name, location, folder_simul, filename_bt))
-        performance_output.to_excel(writer,  sheet_name = 'Performance Indicators')
-        roll_sharpe.to_excel(writer, sheet_name = "Rolling Sharpe")
-        roll_VaR.to_excel(writer, sheet_name = "Rolling VaR")
-        turnover_pf.to_excel(writer, sheet_name = "Turnover")
-        w_risky_vector.to_excel(writer, sheet_name = "Amount_in_Risky_Asset")
-        retPF.to_excel(writer,  sheet_name = 'PF_returns')
-        retAssets.to_excel(writer,  sheet_name='asset_returns')
-        writer.save()
+        tables = backtest_tables(performance_output, roll_sharpe, roll_VaR, turnover_pf, w_risky_vector, retPF)
+        save_backtest(sink if sink is not None else ColumnarSink(), start, end, file, filename_bt,
+                      initial_date_backtest, tables, retAssets)
 
 #    print()
 #    for key, value in performance.items():
@@ -8,6 +8,7 @@ import sys
 sys.path.append('/Users/%s/OneDrive/Master Thesis/Data/Analysis_Skripts/Library/' %name)
 from Functions import *
 from backtest import backtester_NEW2 as BACKTEST
+from backtest import BackgroundWriter, ColumnarSink
 
 #from backtest_control import backtester_NEW2 as BACKTEST
 
@@ -21,6 +22,9 @@ gamma_list = [0.5, 1.0, 1.5, 2.0, 3.0]
 start = "1980-01-01"
 end = "2018-01-01"
 
+#weights written by the Portfolios scripts, file names not found in it are read from csv
+store = WeightStore('/Users/{}/OneDrive/Master Thesis/Data/Portfolios/weight_store'.format(name))
+
 
 GUW = ['GUWPortfoliosM{}-gamma{:3.1f}_epsilon{:3.1f}.csv'.format(year, gamma, eps)
             for year in years_list for gamma in gamma_list for eps in epsilon_list ]
@@ -61,63 +65,65 @@ final_dataframe2 = pd.DataFrame(index = rows2, columns = columns)
 '''loop for garlappi portfolios that for construction already imply a gamma'''
 
 
-for n, i in enumerate(portfolios):
+#results are written on a background thread while the sweep goes on; leaving the with block waits for
+#the last results to be written (also when a backtest fails) and raises the errors of the writer
+with BackgroundWriter(ColumnarSink()) as writer:
+    for n, i in enumerate(portfolios):
             
-    if portfolios[n][:3]=="GUW":
-        retAssets, retPF, performance, file, gamma_GUW, average_pf_return, st_dev_pf, sharpeRatio_pf, turnover_pf_sum, LPM, drawdown, VaR, initial_date_backtest, final_date_backtest, epsilon, info_estimation, CE = BACKTEST(start, end, i, gamma_presence = True, save = True)       
+        if portfolios[n][:3]=="GUW":
+            retAssets, retPF, performance, file, gamma_GUW, average_pf_return, st_dev_pf, sharpeRatio_pf, turnover_pf_sum, LPM, drawdown, VaR, initial_date_backtest, final_date_backtest, epsilon, info_estimation, CE = BACKTEST(start, end, i, gamma_presence = True, save = True, store = store, sink = writer)       
         
-        final_dataframe2.set_value(n, columns[0], file)
-        final_dataframe2.set_value(n, columns[1], gamma_GUW)
-        final_dataframe2.set_value(n, columns[2], info_estimation)
-        final_dataframe2.set_value(n, columns[3], CE)            
-        final_dataframe2.set_value(n, columns[4], average_pf_return)
-        final_dataframe2.set_value(n, columns[5], st_dev_pf)
-        final_dataframe2.set_value(n, columns[6], sharpeRatio_pf)
-        final_dataframe2.set_value(n, columns[7], VaR)
-        final_dataframe2.set_value(n, columns[8], LPM)                          
-        final_dataframe2.set_value(n, columns[9], turnover_pf_sum)
-        final_dataframe2.set_value(n, columns[10], drawdown)
-        epsilon = float(portfolios[n][-7:-4])
-        final_dataframe2.set_value(n, columns[11], epsilon)
-        final_dataframe2.set_value(n, columns[12], initial_date_backtest)
-        final_dataframe2.set_value(n, columns[13], final_date_backtest)
+            final_dataframe2.set_value(n, columns[0], file)
+            final_dataframe2.set_value(n, columns[1], gamma_GUW)
+            final_dataframe2.set_value(n, columns[2], info_estimation)
+            final_dataframe2.set_value(n, columns[3], CE)            
+            final_dataframe2.set_value(n, columns[4], average_pf_return)
+            final_dataframe2.set_value(n, columns[5], st_dev_pf)
+            final_dataframe2.set_value(n, columns[6], sharpeRatio_pf)
+            final_dataframe2.set_value(n, columns[7], VaR)
+            final_dataframe2.set_value(n, columns[8], LPM)                          
+            final_dataframe2.set_value(n, columns[9], turnover_pf_sum)
+            final_dataframe2.set_value(n, columns[10], drawdown)
+            final_dataframe2.set_value(n, columns[11], epsilon)
+            final_dataframe2.set_value(n, columns[12], initial_date_backtest)
+            final_dataframe2.set_value(n, columns[13], final_date_backtest)
         
-    elif portfolios[n][:3]=="Mea" or portfolios[n][:3]=="our" or portfolios[n][:3]=="thr":
-        retAssets, retPF, performance, file, gamma_output, average_pf_return, st_dev_pf, sharpeRatio_pf, turnover_pf_sum, LPM, drawdown, VaR, initial_date_backtest, final_date_backtest, info_estimation, CE  = BACKTEST(start, end, i, gamma_presence = True, save = True)       
+        elif portfolios[n][:3]=="Mea" or portfolios[n][:3]=="our" or portfolios[n][:3]=="thr":
+            retAssets, retPF, performance, file, gamma_output, average_pf_return, st_dev_pf, sharpeRatio_pf, turnover_pf_sum, LPM, drawdown, VaR, initial_date_backtest, final_date_backtest, info_estimation, CE  = BACKTEST(start, end, i, gamma_presence = True, save = True, store = store, sink = writer)       
         
-        final_dataframe2.set_value(n, columns[0], file)
-        final_dataframe2.set_value(n, columns[1], gamma_output)
-        final_dataframe2.set_value(n, columns[2], info_estimation)
-        final_dataframe2.set_value(n, columns[3], CE)                
-        final_dataframe2.set_value(n, columns[4], average_pf_return)
-        final_dataframe2.set_value(n, columns[5], st_dev_pf)
-        final_dataframe2.set_value(n, columns[6], sharpeRatio_pf)
-        final_dataframe2.set_value(n, columns[7], VaR)
-        final_dataframe2.set_value(n, columns[8], LPM)                          
-        final_dataframe2.set_value(n, columns[9], turnover_pf_sum)
-        final_dataframe2.set_value(n, columns[10], drawdown)
-        final_dataframe2.set_value(n, columns[12], initial_date_backtest)
-        final_dataframe2.set_value(n, columns[13], final_date_backtest)    
+            final_dataframe2.set_value(n, columns[0], file)
+            final_dataframe2.set_value(n, columns[1], gamma_output)
+            final_dataframe2.set_value(n, columns[2], info_estimation)
+            final_dataframe2.set_value(n, columns[3], CE)                
+            final_dataframe2.set_value(n, columns[4], average_pf_return)
+            final_dataframe2.set_value(n, columns[5], st_dev_pf)
+            final_dataframe2.set_value(n, columns[6], sharpeRatio_pf)
+            final_dataframe2.set_value(n, columns[7], VaR)
+            final_dataframe2.set_value(n, columns[8], LPM)                          
+            final_dataframe2.set_value(n, columns[9], turnover_pf_sum)
+            final_dataframe2.set_value(n, columns[10], drawdown)
+            final_dataframe2.set_value(n, columns[12], initial_date_backtest)
+            final_dataframe2.set_value(n, columns[13], final_date_backtest)    
     
-    else:
-        retAssets, retPF, performance, file, average_pf_return, st_dev_pf, sharpeRatio_pf, turnover_pf_sum, LPM, drawdown, VaR, initial_date_backtest, final_date_backtest, info_estimation, CE  = BACKTEST(start, end, i, gamma_presence = False, save = True)       
+        else:
+            retAssets, retPF, performance, file, average_pf_return, st_dev_pf, sharpeRatio_pf, turnover_pf_sum, LPM, drawdown, VaR, initial_date_backtest, final_date_backtest, info_estimation, CE  = BACKTEST(start, end, i, gamma_presence = False, save = True, store = store, sink = writer)       
         
-        final_dataframe2.set_value(n, columns[0], file)
-#        final_dataframe2.set_value(n, columns[1], gamma_output)
-        final_dataframe2.set_value(n, columns[2], info_estimation)
-        final_dataframe2.set_value(n, columns[3], CE)                
-        final_dataframe2.set_value(n, columns[4], average_pf_return)
-        final_dataframe2.set_value(n, columns[5], st_dev_pf)
-        final_dataframe2.set_value(n, columns[6], sharpeRatio_pf)
-        final_dataframe2.set_value(n, columns[7], VaR)
-        final_dataframe2.set_value(n, columns[8], LPM)                          
-        final_dataframe2.set_value(n, columns[9], turnover_pf_sum)
-        final_dataframe2.set_value(n, columns[10], drawdown)
-        final_dataframe2.set_value(n, columns[12], initial_date_backtest)
-        final_dataframe2.set_value(n, columns[13], final_date_backtest)
-
-    to_print = (n + 1) / len(portfolios) * 100
-    print("{:05.2f}%".format(to_print))
+            final_dataframe2.set_value(n, columns[0], file)
+    #        final_dataframe2.set_value(n, columns[1], gamma_output)
+            final_dataframe2.set_value(n, columns[2], info_estimation)
+            final_dataframe2.set_value(n, columns[3], CE)                
+            final_dataframe2.set_value(n, columns[4], average_pf_return)
+            final_dataframe2.set_value(n, columns[5], st_dev_pf)
+            final_dataframe2.set_value(n, columns[6], sharpeRatio_pf)
+            final_dataframe2.set_value(n, columns[7], VaR)
+            final_dataframe2.set_value(n, columns[8], LPM)                          
+            final_dataframe2.set_value(n, columns[9], turnover_pf_sum)
+            final_dataframe2.set_value(n, columns[10], drawdown)
+            final_dataframe2.set_value(n, columns[12], initial_date_backtest)
+            final_dataframe2.set_value(n, columns[13], final_date_backtest)
+
+        to_print = (n + 1) / len(portfolios) * 100
+        print("{:05.2f}%".format(to_print))
 
 
         
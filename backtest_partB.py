@@ -28,6 +28,8 @@ start = "1980-01-01"
 
 end = "2018-01-01"
 
+#weights written by the Portfolios scripts, file names not found in it are read from csv
+store = WeightStore('/Users/{}/OneDrive/Master Thesis/Data/Portfolios/weight_store'.format(name))
 
 GUW = ['GUWPortfoliosM{}-gamma{:3.1f}_epsilon{:3.1f}.csv'.format(year, gamma, eps)
             for year in years_list for gamma in gamma_list for eps in epsilon_list ]
@@ -62,7 +64,7 @@ final_dataframe2 = pd.DataFrame(index = rows2, columns = columns)
 
 for gamma in gamma_list:
     for n, i in enumerate(portfolios):
-        retAssets, retPF, performance, file, gamma_output, average_pf_return, st_dev_pf, sharpeRatio_pf, turnover_pf_sum, LPM, drawdown, VaR, initial_date_backtest, final_date_backtest, info_estimation, CE = backtester_withGamma(start, end, i, gamma, save = True)       
+        retAssets, retPF, performance, file, gamma_output, average_pf_return, st_dev_pf, sharpeRatio_pf, turnover_pf_sum, LPM, drawdown, VaR, initial_date_backtest, final_date_backtest, info_estimation, CE = backtester_withGamma(start, end, i, gamma, save = True, store = store)       
         
         to_print = (n + 1) / len(portfolios) * 100
         print("{:05.2f}%".format(to_print))
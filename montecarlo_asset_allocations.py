@@ -55,6 +55,8 @@ varCovar = varCovar[:nAssets,:nAssets]
 
 
 choleskyMat = np.linalg.cholesky(varCovar)      # Cholesky Matrix of varCovar
+choleskyMat_T = np.asarray(choleskyMat.T)
+meanRet_T = np.asarray(meanRet.T)
 
 '''Calculate the true weights and true portfolio characteristics'''
 truePi = tangWeights(np.array(meanRet), varCovar, rf_annual, gamma)
@@ -102,9 +104,9 @@ for n in range(MCSize):
     '''assign random values to random value matrix'''
     randomMat = np.random.normal(0.,1.,(estLength, nAssets))
     '''induce correlation to the random values by multiplying those with the Cholesky Decomposition'''
-    corrRandomMat = np.dot(randomMat, choleskyMat.T) 
+    corrRandomMat = np.dot(randomMat, choleskyMat_T) 
     '''simulate correlated returns over 60 months for nAssets'''
-    corrReturns = np.array(meanRet.T) +  np.array(corrRandomMat)
+    corrReturns = meanRet_T + corrRandomMat
     estMu = np.asmatrix(np.mean(corrReturns, axis = 0)).T
     estSigma = np.asmatrix(np.cov(corrReturns.T, ddof=1))
     
@@ -116,8 +118,8 @@ for n in range(MCSize):
     #calculate allocation according to estimated parameters in the simulation
     minvar = minVarPF1(estSigma)
     #calculate exp ret and stdev of portfolio, with true parameters, but with the weights calculated before
-    meanRet_minVar = PF_return(minvar, meanRet)
-    sigma_minVar = np.sqrt(PF_variance(minvar, varCovar))
+    meanRet_minVar = PF_return_nd(minvar, meanRet)
+    sigma_minVar = PF_volatility_nd(minvar, varCovar)
     # method calculates the portfolio characteristics (mu_pf, sigma_pf) and utility 
     utility_i_min_var.append(utility_MV(meanRet_minVar, sigma_minVar, gamma))
 
@@ -125,8 +127,8 @@ for n in range(MCSize):
     #calculate allocation according to estimated parameters in the simulation
     maxsharpe = maxSRPF1(estMu, estSigma, rf)
     #calculate exp ret and stdev of portfolio, with true parameters, but with the weights calculated before
-    meanRet_maxsharpe = PF_return(maxsharpe, meanRet)
-    sigma_maxsharpe = np.sqrt(PF_variance(maxsharpe, varCovar))
+    meanRet_maxsharpe = PF_return_nd(maxsharpe, meanRet)
+    sigma_maxsharpe = PF_volatility_nd(maxsharpe, varCovar)
     # method calculates the portfolio characteristics (mu_pf, sigma_pf) and utility 
     utility_i_max_sharpe.append(utility_MV(meanRet_maxsharpe, sigma_maxsharpe, gamma))
 #    maxsharpe = maxSRPF1(estMu, estSigma, rf)
@@ -136,8 +138,8 @@ for n in range(MCSize):
     #calculate allocation according to estimated parameters in the simulation
     GWPF = GWweights1(corrReturns, estMu, estSigma, epsilon, gamma)
     #calculate exp ret and stdev of portfolio, with true parameters, but with the weights calculated before
-    meanRet_GWPF = PF_return(GWPF, meanRet)
-    sigma_GWPF = np.sqrt(PF_variance(GWPF, varCovar))
+    meanRet_GWPF = PF_return_nd(GWPF, meanRet)
+    sigma_GWPF = PF_volatility_nd(GWPF, varCovar)
     # method calculates the portfolio characteristics (mu_pf, sigma_pf) and utility 
     utility_i_GWPF.append(utility_MV(meanRet_GWPF, sigma_GWPF, gamma))
 
@@ -146,24 +148,24 @@ for n in range(MCSize):
 #    #calculate allocation according to estimated parameters in the simulation
 #    RP_pf = riskParity(estSigma)
 #    #calculate exp ret and stdev of portfolio, with true parameters, but with the weights calculated before
-#    meanRet_RP_pf = PF_return(RP_pf, meanRet)
-#    sigma_RP_pf = np.sqrt(PF_variance(RP_pf, varCovar))
+#    meanRet_RP_pf = PF_return_nd(RP_pf, meanRet)
+#    sigma_RP_pf = PF_volatility_nd(RP_pf, varCovar)
 #    # method calculates the portfolio characteristics (mu_pf, sigma_pf) and utility 
 #    utility_i_RP_pf.append(utility_MV(meanRet_RP_pf, sigma_RP_pf, gamma))
 #    
 #    
 #    #lower partial moments portfolio
 #    LPM_pf = lpm_port(estMu, corrReturns)
-#    meanRet_LPM_pf = PF_return(LPM_pf, meanRet)
-#    sigma_LPM_pf = np.sqrt(PF_variance(LPM_pf, varCovar))
+#    meanRet_LPM_pf = PF_return_nd(LPM_pf, meanRet)
+#    sigma_LPM_pf = PF_volatility_nd(LPM_pf, varCovar)
 #    # method calculates the portfolio characteristics (mu_pf, sigma_pf) and utility 
 #    utility_i_LPM_pf.append(utility_MV(meanRet_LPM_pf, sigma_LPM_pf, gamma))
     
     # 1 over N
     over_N_pf = np.asmatrix([1 / nAssets for i in range(nAssets)]).T
     #calculate exp ret and stdev of portfolio, with true parameters, but with the weights calculated before
-    meanRet_over_N_pf = PF_return(over_N_pf, meanRet)
-    sigma_over_N_pf = np.sqrt(PF_variance(over_N_pf, varCovar))
+    meanRet_over_N_pf = PF_return_nd(over_N_pf, meanRet)
+    sigma_over_N_pf = PF_volatility_nd(over_N_pf, varCovar)
     # method calculates the portfolio characteristics (mu_pf, sigma_pf) and utility 
     utility_i_over_N_pf.append(utility_MV(meanRet_over_N_pf, sigma_over_N_pf, gamma))
     
@@ -172,8 +174,8 @@ for n in range(MCSize):
     #calculate allocation according to estimated parameters in the simulation
     hierarchical_pf = getHRP(estSigma)
     #calculate exp ret and stdev of portfolio, with true parameters, but with the weights calculated before
-    meanRet_hierarchical_pf = PF_return(hierarchical_pf, meanRet)
-    sigma_hierarchical_pf = np.sqrt(PF_variance(hierarchical_pf, varCovar))
+    meanRet_hierarchical_pf = PF_return_nd(hierarchical_pf, meanRet)
+    sigma_hierarchical_pf = PF_volatility_nd(hierarchical_pf, varCovar)
     # method calculates the portfolio characteristics (mu_pf, sigma_pf) and utility 
     utility_i_hierarchical_pf.append(utility_MV(meanRet_hierarchical_pf, sigma_hierarchical_pf, gamma))
     
@@ -0,0 +1,50 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from Functions import read_excel_cached
+
+
+def _workbook(path):
+    dates = pd.date_range('2000-01-31', periods = 6, freq = 'M')
+    returns = pd.DataFrame(np.arange(12.).reshape(6, 2) / 100, index = pd.Index(dates, name = 'Code'),
+                           columns = ['A', 'B'])
+    labels = pd.DataFrame({'name': ['x', 'y'], 'weight': [0.25, 0.75]}, index = pd.Index(['a', 'b'], name = 'Code'))
+    with pd.ExcelWriter(path) as writer:
+        returns.to_excel(writer, sheet_name = 'returns')
+        labels.to_excel(writer, sheet_name = 'labels')
+
+
+def test_cold_and_warm_loads_round_trip(tmp_path):
+    path = str(tmp_path / 'data.xlsx')
+    _workbook(path)
+    cold = read_excel_cached(path, ['returns', 'labels'])
+    assert os.listdir(str(tmp_path / '.cache'))
+    warm = read_excel_cached(path, ['returns', 'labels'])
+    for sheet in ('returns', 'labels'):
+        pd.testing.assert_frame_equal(cold[sheet], warm[sheet])
+
+
+def test_changed_mtime_same_content_uses_cache(tmp_path):
+    path = str(tmp_path / 'data.xlsx')
+    _workbook(path)
+    cold = read_excel_cached(path, ['returns'])
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+    warm = read_excel_cached(path, ['returns'])
+    pd.testing.assert_frame_equal(cold['returns'], warm['returns'])
+
+
+def test_changed_workbook_is_parsed_again(tmp_path):
+    path = str(tmp_path / 'data.xlsx')
+    _workbook(path)
+    read_excel_cached(path, ['returns'])
+    frame = pd.DataFrame({'A': [1.5], 'B': [2.5]}, index = pd.Index(['r'], name = 'Code'))
+    with pd.ExcelWriter(path) as writer:
+        frame.to_excel(writer, sheet_name = 'returns')
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+    pd.testing.assert_frame_equal(read_excel_cached(path, ['returns'])['returns'], frame)